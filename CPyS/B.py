@@ -111,9 +111,90 @@ def B(th, geopt, SH=False, names=["snap_z900", "snap_z600"]):  # TODO: Useless?
     )
 
 
-def B_vector(th_vec, z900, z600, lat):
+def sector_weights(az, th):
+    """
+    Computes the signed azimuthal weights separating right and left of the th line.
+
+    Parameters
+    ----------
+    az (np.ndarray): The azimuths of the snapshots grid (in degrees)
+    th (np.ndarray): The direction for each snapshot (in degrees), already snapped to az
+
+    Returns
+    -------
+    S (np.ndarray): (snapshot, az) matrix, +1 on the right, -1 on the left and 0 on the th line.
+    """
+    A_shift = (az[np.newaxis, :] - th[:, np.newaxis]) % 360
+    S = np.zeros(A_shift.shape, dtype=np.int8)
+    S[A_shift > 180] = 1
+    S[(A_shift > 0) & (A_shift < 180)] = -1
+    return S
+
+
+def B_vector(th_vec, z900, z600, lat, grid=None):
+    """
+    Computes the B parameter for a vector of points, with the corresponding snapshot of geopt at 600hPa and 900hPa
+    The right-left difference of weighted means is obtained with one contraction of the field
+    with the sector weights and the area weights, without masked copies of the field.
+
+    The fields can have other dimensions than snapshot (e.g. an ensemble member dimension),
+    in which case th_vec and lat have the shape of these dimensions, in the order of the fields,
+    and all the points are computed in one pass.
+
+    Parameters
+    ----------
+    th_vec : The theta parameter for each point
+    z900 : The z900 field for each point
+    z600 : The z600 field for each point
+    lat : The latitude of each point
+    grid (PolarGrid) : The precomputed geometry of the snapshots, see CPyS.grid.
+
+    Returns
+    -------
+    B, the Hart phase space parameter for symetry, with the dimensions of the fields other than r and az.
+    """
+    # Curate input
+    if type(th_vec) != np.ndarray:
+        th_vec = np.asarray(th_vec)
+    th_vec = th_vec.ravel()
+
+    ΔZ = z600 - z900
+    if grid is None:
+        th = ΔZ.az.sel(az=th_vec, method="nearest").az.values  # Select nearest available az to theta
+        w = area_weights(ΔZ).values
+    else:
+        th = grid.az[grid.snap(th_vec)]
+        w = grid.weights
+    S = sector_weights(ΔZ.az.values, th)
+    R, L = (S > 0), (S < 0)
+    ΔZ = ΔZ.transpose(..., "r", "az")
+    shape = ΔZ.shape[:-2]  # Points dimensions, flattened for the computation
+    Z = ΔZ.values.reshape((-1,) + ΔZ.shape[-2:])
+    valid = ~np.isnan(Z)
+
+    # The contractions accumulate in float64 whatever the type of the field, without copying it
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if valid.all():
+            # Signed weights: mean over the right side minus mean over the left side
+            W = R / R.sum(axis=1, keepdims=True) - L / L.sum(axis=1, keepdims=True)
+            b = np.einsum("sra,r,sa->s", Z, w / w.sum(), W, dtype=np.float64)
+        else:
+            # Missing values are excluded from each side's weighted mean
+            Z[~valid] = 0  # Z is a temporary (ΔZ), so it can be modified in place
+            M = np.stack([R, L], axis=-1).astype(float)  # (snapshot, az, side)
+            num = np.einsum("sra,r,sak->sk", Z, w, M, dtype=np.float64)
+            den = np.einsum("sra,r,sak->sk", valid, w, M, dtype=np.float64)
+            mean = np.where(den > 0, num / den, np.nan)
+            b = mean[:, 0] - mean[:, 1]
+
+    h = np.where(np.asarray(lat).ravel() < 0, -1, 1)
+    return ΔZ.isel(r=0, az=0, drop=True).copy(data=(h * b).reshape(shape))
+
+
+def B_vector_masks(th_vec, z900, z600, lat):
     """
     Computes the B parameter for a vector of points, with the corresponding snapshot of geopt at 600hPa and 900hPa
+    Reference implementation based on masked copies of the field, see B_vector for the faster version.
 
     Parameters
     ----------
@@ -1,49 +1,40 @@
-from .theta import theta_multitrack
+from .theta import theta_multitrack, theta_vector
 from .B import B_vector
 from .VT import VT
+from .grid import PolarGrid, needed_levels
+from .profiling import logger, get_profiler
+from .inputs import open_snapshots, snapshot_chunks, chunk_bounds
+from .index import check_alignment
+from .cache import ResultCache, file_fingerprint, hash_arrays
+from . import __version__
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import pandas as pd
 import numpy as np
 import xarray as xr
 
 
-def compute_CPS_parameters(
-    tracks,
-    geopt,
-    geopt_name="snap_zg",
-    plev_name="level",
-    verbose=True,
-):
+def curate_tracks(tracks):
     """
-    Computes the three (+ theta) Hart parameters for all the points in tracks.
+    Checks the type of the tracks and adds the time column if needed.
 
     Parameters
     ----------
-    tracks (pd.DataFrame): The set of TC points
-    geopt (xr.DataSet): The geopotential snapshots associated with the tracks
-        level coordinate must be in Pa.
-    geopt_name (str): Provide the name of the 3D (plev, r, az) geopt snapshots variables as a string.
-    plev_name (str): name of the vertical coordinate in the geopt file.
+    tracks (pd.DataFrame or xr.Dataset): The set of TC points
 
     Returns
     -------
-    tracks (pd.DataFrame): The set of TC points with four new columns corresponding to the parameters
+    tracks (pd.DataFrame): The set of TC points, or None if the type is not recognized.
     """
-
-    # Curate input
-    ## geopt snapshots
-    geopt = geopt.rename({plev_name: "plev"})  # Change vertical coordinate name
-    geopt = geopt.where(np.abs(geopt[geopt_name]) < 1e10)
-
-    ## tracks
     ### Test type
     if type(tracks) == xr.Dataset:
         tracks = tracks.to_dataframe()
     elif type(tracks) == pd.DataFrame:
         pass
-    else: 
+    else:
         print("Type of tracks not recognized. Please provide a pandas dataframe or an xarray dataset.\nNote: If you are using huracanpy to load the tracks, the object is an xarray Dataset.")
         return None
-              
+
     ### Time
     if "time" not in tracks.columns: ## Todo: Replace with huracanpy's get time?
         tracks["time"] = pd.to_datetime(
@@ -52,46 +43,543 @@ def compute_CPS_parameters(
             tracks.day.astype(str) + '-' +
             tracks.hour.astype(str) + ":00:00"
         )
+    return tracks
 
-    # 1/ B computation
-    if verbose:
-        print("Computing B...")
-    ## Select 900 & 600 hPa levels
-    z900, z600 = (
-        geopt[geopt_name].sel(plev=900e2, method="nearest"),
-        geopt[geopt_name].sel(plev=600e2, method="nearest"),
-    )
-    if verbose:
-        print(
-            "Level "
-            + str(z900.plev.values)
-            + " is taken for 900hPa"
-            + "\n"
-            + "Level "
-            + str(z600.plev.values)
-            + " is taken for 600hPa"
-            + "\n"
-        )
 
-    ## theta computation
-    if "theta" not in tracks.columns:
-        tracks = tracks.assign(theta=theta_multitrack(tracks))
+def prepare_geopt(
+    geopt,
+    geopt_name="snap_zg",
+    plev_name="level",
+    B_levels=(900e2, 600e2),
+    VT_levels=(950e2, 600e2, 250e2),
+    grid=None,
+):
+    """
+    Selects the snapshots variable and the levels used, and renames the vertical coordinate to plev.
+    Nothing is read from the disk if geopt was opened lazily.
+
+    Returns
+    -------
+    geopt (xr.DataSet): The snapshots, with levels by decreasing pressure.
+    """
+    geopt = geopt[[geopt_name]].rename({plev_name: "plev"})  # Change vertical coordinate name
+    if grid is None:
+        levels = needed_levels(geopt.plev.values, B_levels, VT_levels)
+    else:
+        levels = grid.levels
+    return geopt.isel(plev=levels)  # Only read the levels used
+
 
-    ## B computation
-    tracks = tracks.assign(
-        B=B_vector(tracks.theta.values, z900, z600, tracks.lat.values)
+def select_members(geopt, tracks):
+    """
+    Selects the snapshot of each point of an ensemble of tracks, for snapshots with a member dimension.
+    The points of each member in tracks correspond, in order, to the snapshots of this member,
+    so that members can have different numbers of points (the remaining snapshots being padding).
+
+    Parameters
+    ----------
+    geopt (xr.DataSet): The snapshots, with member and snapshot dimensions.
+    tracks (pd.DataFrame): The set of TC points, with a member column.
+
+    Returns
+    -------
+    geopt (xr.DataSet): The snapshots with a flat snapshot dimension following the points of tracks,
+        so that all the members are computed in one pass.
+    """
+    assert "member" in tracks.columns, "The snapshots have a member dimension, but the tracks have no member column."
+    member = geopt.get_index("member").get_indexer(tracks.member.values)
+    assert (member >= 0).all(), "Some members of the tracks are not in the snapshots."
+    snapshot = tracks.groupby("member", sort=False).cumcount().values
+    assert (
+        snapshot < geopt.sizes["snapshot"]
+    ).all(), "Some members of the tracks have more points than snapshots."
+    return geopt.isel(
+        member=xr.DataArray(member, dims="snapshot"),
+        snapshot=xr.DataArray(snapshot, dims="snapshot"),
     )
 
+
+def mask_fill_values(z, profiler=None, inplace=False):
+    """
+    Replaces the fill values (|z| >= 1e10) of a snapshots DataArray by NaN.
+
+    Parameters
+    ----------
+    z (xr.DataArray): The geopotential snapshots
+    profiler (Profiler): Counts the number of masked snapshots.
+    inplace (bool): Modify the data of z in place, so that no full-size copy is made.
+        Only for data that is not shared with the caller, e.g. a chunk freshly loaded for the computation.
+
+    Returns
+    -------
+    z (xr.DataArray): The masked snapshots
+    """
+    values = z.values
+    if not (inplace and values.flags.writeable):
+        values = values.copy()
+    with np.errstate(invalid="ignore"):
+        bad = values >= 1e10
+        bad |= values <= -1e10
+    np.copyto(values, np.nan, where=bad)
+    if profiler is not None:
+        bad |= np.isnan(values)
+        axes = tuple(i for i, d in enumerate(z.dims) if d != "snapshot")
+        profiler.count("masked_snapshots", bad.any(axis=axes).sum())
+    return z.copy(data=values)
+
+
+def compute_chunk(
+    geopt,
+    th,
+    lat,
+    geopt_name="snap_zg",
+    B_levels=(900e2, 600e2),
+    VT_levels=(950e2, 600e2, 250e2),
+    profiler=None,
+    dtype=None,
+    grid=None,
+    owned=False,
+):
+    """
+    Computes B, VTL and VTU for a set of snapshots.
+
+    Parameters
+    ----------
+    geopt (xr.DataSet): The geopotential snapshots, with vertical coordinate plev (in Pa).
+    th (np.ndarray): The theta parameter for each snapshot
+    lat (np.ndarray): The latitude of each snapshot
+    geopt_name (str): Name of the 3D (plev, r, az) geopt snapshots variable.
+    B_levels (tuple): Lower and upper levels (in Pa) of the thickness used for B.
+    VT_levels (tuple): Bottom, middle and top levels (in Pa) of the layers used for VTL and VTU.
+    profiler (Profiler or callable): Collects the time and memory of each stage, see CPyS.profiling.Profiler.
+    dtype: Data type used for the snapshots (e.g. np.float32). Defaults to the type of geopt.
+    grid (PolarGrid): The precomputed geometry of the snapshots, see CPyS.grid. If provided, its levels are used
+        and geopt must contain the levels grid.plev, as returned by prepare_geopt.
+    owned (bool): geopt is not shared with the caller (e.g. freshly loaded), so its fill values
+        can be replaced by NaN in place (see mask_fill_values) instead of in a copy.
+
+    Returns
+    -------
+    B, VTL, VTU (np.ndarray): The Hart parameters for each snapshot.
+    """
+    profiler = get_profiler(profiler)
+
+    with profiler.stage("mask"):
+        z = geopt[geopt_name]
+        if dtype is not None and z.dtype != dtype:
+            z = z.astype(dtype)
+            owned = True  # New array
+        geopt = geopt.assign({geopt_name: mask_fill_values(z, profiler, inplace=owned)})
+
+    # 1/ B computation
+    with profiler.stage("B"):
+        if grid is None:
+            z900, z600 = (
+                geopt[geopt_name].sel(plev=B_levels[0], method="nearest"),
+                geopt[geopt_name].sel(plev=B_levels[1], method="nearest"),
+            )
+        else:
+            z900, z600 = (
+                geopt[geopt_name].isel(plev=grid.B_idx[0]),
+                geopt[geopt_name].isel(plev=grid.B_idx[1]),
+            )
+        B = B_vector(th, z900, z600, lat, grid=grid).values
+
     # 2/ VTL & VTU computation
-    if verbose:
-        print("Computing VTL & VTU...")
-    geopt = geopt.sortby("plev", ascending=False)
-    VTL, VTU = VT(geopt, name=geopt_name)
+    with profiler.stage("VT"):
+        if grid is None and not (np.diff(geopt.plev.values) < 0).all():
+            geopt = geopt.sortby("plev", ascending=False)
+        VTL, VTU = VT(geopt, name=geopt_name, levels=VT_levels, grid=grid)
 
-    # Output
-    tracks = tracks.assign(VTL=VTL, VTU=VTU)
+    profiler.count("snapshots", len(B))
+    profiler.count("NaN_B", np.isnan(B).sum())
+    profiler.count("NaN_VTL", np.isnan(VTL).sum())
+    profiler.count("NaN_VTU", np.isnan(VTU).sum())
+    return B, VTL, VTU
 
-    return tracks
+
+def iter_CPS_parameters(
+    tracks,
+    geopt,
+    geopt_name="snap_zg",
+    plev_name="level",
+    chunk_size=1000,
+    verbose=True,
+    B_levels=(900e2, 600e2),
+    VT_levels=(950e2, 600e2, 250e2),
+    profiler=None,
+    dtype=None,
+    grid=None,
+    prefetch=True,
+    index=None,
+    cache=None,
+):
+    """
+    Computes the three (+ theta) Hart parameters for all the points in tracks, by chunks of snapshots.
+    Only one chunk of snapshots is loaded at a time (and the next one while it is computed),
+    so that geopt can be a file opened lazily (e.g. with xr.open_dataset) larger than the available memory.
+    Only the geopt_name variable and the levels needed for B and VT are read.
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The set of TC points
+    geopt (xr.DataSet, str or list): The geopotential snapshots associated with the tracks
+        level coordinate must be in Pa.
+        Can also be the path to a NetCDF file or a Zarr store, or a list (or glob pattern) of NetCDF files
+        concatenated along snapshot, see CPyS.inputs.open_snapshots.
+        For ensembles, geopt can have a member dimension, and tracks a member column: the points of each member
+        correspond, in order, to the snapshots of this member (see select_members). All the members are computed at once.
+    geopt_name (str): Provide the name of the 3D (plev, r, az) geopt snapshots variables as a string.
+    plev_name (str): name of the vertical coordinate in the geopt file.
+    chunk_size (int): Number of snapshots processed at once.
+        If geopt is chunked along snapshot (on disk or with dask), the chunks are extended to whole chunks of geopt.
+    verbose (bool): Log the progress at INFO level on the "CPyS" logger (DEBUG level otherwise).
+    B_levels (tuple): Lower and upper levels (in Pa) of the thickness used for B.
+    VT_levels (tuple): Bottom, middle and top levels (in Pa) of the layers used for VTL and VTU.
+    profiler (Profiler or callable): Collects the time and memory of each stage, see CPyS.profiling.Profiler.
+    dtype: Data type used for the snapshots, e.g. np.float32 to halve the memory use of float64 files.
+        B and VT accumulate in float64 in any case.
+    grid (PolarGrid): The precomputed geometry of the snapshots (see CPyS.grid), to reuse for files on the same grid.
+        If provided, its levels are used instead of B_levels and VT_levels.
+    prefetch (bool): Read the next chunk of snapshots in a background thread while the current one is computed.
+    index (SnapshotIndex): The position of the snapshot of each (track_id, time) point, see CPyS.index.
+        If provided, tracks can be any subset of the points, in any order, and only their snapshots are read.
+        Otherwise, the i-th point of tracks must correspond to the i-th snapshot, which is checked
+        against the time of the snapshots (snap_time) when available.
+    cache (ResultCache or str): On-disk cache (or its directory) of the parameters of each chunk, see CPyS.cache.
+        Chunks whose inputs did not change are taken from the cache instead of being computed.
+        Snapshots given as paths are identified by the size and modification time of the files, without reading them;
+        snapshots given as a Dataset are identified by the content of each chunk, which is read but not computed.
+
+    Yields
+    ------
+    tracks (pd.DataFrame): Consecutive chunks of the set of TC points with four new columns corresponding to the parameters
+    """
+
+    profiler = get_profiler(profiler)
+    level = logging.INFO if verbose else logging.DEBUG
+
+    # Snapshots given as paths are opened here, and closed when the iteration ends
+    source = geopt
+    with profiler.stage("curation"):
+        opened = open_snapshots(source, geopt_name)
+    try:
+        # Curate input
+        with profiler.stage("curation"):
+            ## tracks
+            tracks = curate_tracks(tracks)
+            if tracks is None:
+                return
+
+            ## geopt snapshots
+            geopt = opened
+            disk_chunks = snapshot_chunks(geopt, geopt_name)
+            source_positions = np.arange(len(tracks))  # Position of the snapshot of each point in geopt
+            if index is not None:
+                source_positions = index.positions(tracks)
+                disk_chunks = None
+            elif "member" in geopt.dims:
+                source_positions = tracks.groupby("member", sort=False).cumcount().values  # See select_members
+            else:
+                check_alignment(tracks, geopt)
+            if grid is None:
+                grid = PolarGrid.from_dataset(geopt, plev_name, B_levels, VT_levels)
+            else:
+                grid.check(geopt, plev_name)
+            geopt = prepare_geopt(geopt, geopt_name, plev_name, grid=grid)
+
+            ## ensemble members
+            if "member" in geopt.dims:
+                geopt = select_members(geopt, tracks)
+                disk_chunks = None
+            ## subset of points: only their snapshots are read
+            elif index is not None:
+                geopt = geopt.isel(snapshot=source_positions)
+
+        for l, i in zip(grid.B_levels, grid.B_idx):
+            logger.log(level, "Level %s is taken for %shPa", grid.plev[i], int(l / 100))
+
+        ## theta computation (on the whole tracks, as it depends on the next point)
+        if "theta" not in tracks.columns:
+            with profiler.stage("theta"):
+                if index is None:
+                    tracks = tracks.assign(theta=theta_multitrack(tracks))
+                else:  # The points can be in any order
+                    order = tracks.reset_index(drop=True).sort_values(["track_id", "time"], kind="stable").index.values
+                    th = np.empty(len(tracks))
+                    th[order] = theta_multitrack(tracks.iloc[order])
+                    tracks = tracks.assign(theta=th)
+
+        # Computation of B, VTL & VTU for each chunk of snapshots
+        bounds = chunk_bounds(len(tracks), chunk_size, disk_chunks)
+
+        # The chunks never share memory with the caller's data: they are either loaded from the disk, or views of geopt
+        # after prepare_geopt, whose selection of levels by an array of indices copies in-memory data.
+        # So their fill values can be masked in place.
+        def read(i):
+            start, stop = bounds[i]
+            return geopt.isel(snapshot=slice(start, stop)).load()
+
+        ## cached chunks
+        if cache is not None:
+            if not isinstance(cache, ResultCache):
+                cache = ResultCache(cache)
+            # Files are identified without reading them; Datasets from the snapshots of each chunk
+            fingerprint = None if isinstance(source, xr.Dataset) else file_fingerprint(source)
+            common_key = hash_arrays(
+                __version__, geopt_name, plev_name, grid.B_levels, grid.VT_levels,
+                grid.plev, grid.r, grid.az, str(dtype), fingerprint,
+            )
+            cols = [c for c in ["member", "track_id", "time", "lon", "lat", "theta"] if c in tracks.columns]
+
+            def chunk_key(i, geopt_chunk=None):
+                start, stop = bounds[i]
+                data = None if fingerprint is not None else geopt_chunk[geopt_name].values
+                return hash_arrays(
+                    common_key, *[tracks[c].values[start:stop] for c in cols], source_positions[start:stop], data
+                )
+
+        keys, hits = [None] * len(bounds), [None] * len(bounds)
+        if cache is not None and fingerprint is not None:
+            with profiler.stage("cache"):
+                keys = [chunk_key(i) for i in range(len(bounds))]
+                hits = [cache.get(key) for key in keys]
+        to_read = iter([i for i, hit in enumerate(hits) if hit is None])
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            if prefetch:
+                future = pool.submit(read, next(to_read)) if None in hits else None
+            for i, (start, stop) in enumerate(bounds):
+                chunk = tracks.iloc[start:stop]
+                if hits[i] is None:
+                    with profiler.stage("read"):  # Only the time waiting for the reading when prefetching
+                        geopt_chunk = future.result() if prefetch else read(next(to_read))
+                    if prefetch:
+                        following = next(to_read, None)
+                        if following is not None:
+                            future = pool.submit(read, following)
+                    if cache is not None and keys[i] is None:
+                        with profiler.stage("cache"):
+                            keys[i] = chunk_key(i, geopt_chunk)
+                            hits[i] = cache.get(keys[i])
+                if hits[i] is not None:
+                    logger.log(level, "Using cached B, VTL & VTU for snapshots %d to %d", start, stop)
+                    profiler.count("cached_snapshots", stop - start)
+                    yield chunk.assign(**hits[i])
+                    continue
+
+                logger.log(level, "Computing B, VTL & VTU for snapshots %d to %d...", start, stop)
+                B, VTL, VTU = compute_chunk(
+                    geopt_chunk,
+                    chunk.theta.values,
+                    chunk.lat.values,
+                    geopt_name=geopt_name,
+                    B_levels=B_levels,
+                    VT_levels=VT_levels,
+                    profiler=profiler,
+                    dtype=dtype,
+                    grid=grid,
+                    owned=True,
+                )
+                if cache is not None:
+                    with profiler.stage("cache"):
+                        cache.put(keys[i], theta=chunk.theta.values, B=B, VTL=VTL, VTU=VTU)
+                yield chunk.assign(B=B, VTL=VTL, VTU=VTU)
+    finally:
+        if opened is not source:
+            opened.close()
+
+
+def compute_CPS_parameters(
+    tracks,
+    geopt,
+    geopt_name="snap_zg",
+    plev_name="level",
+    verbose=True,
+    chunk_size=None,
+    B_levels=(900e2, 600e2),
+    VT_levels=(950e2, 600e2, 250e2),
+    profiler=None,
+    dtype=None,
+    grid=None,
+    prefetch=True,
+    index=None,
+    cache=None,
+):
+    """
+    Computes the three (+ theta) Hart parameters for all the points in tracks.
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The set of TC points
+    geopt (xr.DataSet, str or list): The geopotential snapshots associated with the tracks
+        level coordinate must be in Pa.
+        Can also be the path to a NetCDF file or a Zarr store, or a list (or glob pattern) of NetCDF files,
+        see CPyS.inputs.open_snapshots.
+        For ensembles, geopt can have a member dimension, and tracks a member column: the points of each member
+        correspond, in order, to the snapshots of this member (see select_members). All the members are computed at once.
+    geopt_name (str): Provide the name of the 3D (plev, r, az) geopt snapshots variables as a string.
+    plev_name (str): name of the vertical coordinate in the geopt file.
+    verbose (bool): Log the progress and the time spent in each stage at INFO level on the "CPyS" logger
+        (DEBUG level otherwise). Use e.g. logging.basicConfig(level=logging.INFO) to display them.
+    chunk_size (int): If provided, the snapshots are processed by chunks of this size (see iter_CPS_parameters),
+        so that the memory use does not depend on the size of geopt.
+    B_levels (tuple): Lower and upper levels (in Pa) of the thickness used for B.
+    VT_levels (tuple): Bottom, middle and top levels (in Pa) of the layers used for VTL and VTU.
+    profiler (Profiler or callable): Collects the time and memory of each stage, and counts of masked
+        and NaN snapshots, see CPyS.profiling.Profiler. A callable is called as callback(stage, stats).
+    dtype: Data type used for the snapshots, e.g. np.float32 to halve the memory use of float64 files.
+        B and VT accumulate in float64 in any case.
+    grid (PolarGrid): The precomputed geometry of the snapshots (see CPyS.grid), to reuse for files on the same grid.
+        If provided, its levels are used instead of B_levels and VT_levels.
+    prefetch (bool): When processing by chunks, read the next chunk of snapshots while the current one is computed.
+    index (SnapshotIndex): The position of the snapshot of each (track_id, time) point, see CPyS.index.
+        If provided, tracks can be any subset of the points, in any order, and only their snapshots are read.
+        theta is computed from the points of the subset, so whole tracks should be selected.
+    cache (ResultCache or str): On-disk cache (or its directory) of the parameters of each chunk, see CPyS.cache
+        and iter_CPS_parameters. Reruns with unchanged inputs (and the same chunk_size) only read the cache.
+
+    Returns
+    -------
+    tracks (pd.DataFrame): The set of TC points with four new columns corresponding to the parameters
+    """
+    tracks = curate_tracks(tracks)  # len of a (huracanpy) Dataset is its number of variables, not of points
+    if tracks is None:
+        return None
+    if chunk_size is None:
+        chunk_size = max(len(tracks), 1)
+    profiler = get_profiler(profiler)
+
+    chunks = list(
+        iter_CPS_parameters(
+            tracks,
+            geopt,
+            geopt_name=geopt_name,
+            plev_name=plev_name,
+            chunk_size=chunk_size,
+            verbose=verbose,
+            B_levels=B_levels,
+            VT_levels=VT_levels,
+            profiler=profiler,
+            dtype=dtype,
+            grid=grid,
+            prefetch=prefetch,
+            index=index,
+            cache=cache,
+        )
+    )
+    if len(chunks) == 0:
+        return None
+
+    logger.log(logging.INFO if verbose else logging.DEBUG, "Stages:\n%s", profiler.summary())
+    return pd.concat(chunks)
+
+
+def update_CPS_parameters(
+    previous,
+    tracks,
+    geopt,
+    previous_geopt=None,
+    geopt_name="snap_zg",
+    plev_name="level",
+    verbose=True,
+    B_levels=(900e2, 600e2),
+    VT_levels=(950e2, 600e2, 250e2),
+    profiler=None,
+    dtype=None,
+    grid=None,
+):
+    """
+    Updates the Hart parameters with new track points, e.g. at each cycle of an operational forecast.
+    Only the new points and the last previous point of each continuing track are computed:
+    the direction of the latter, and therefore its B, change with the new point.
+    The result is the same as recomputing everything with compute_CPS_parameters.
+
+    Parameters
+    ----------
+    previous (pd.DataFrame): The previous output of compute_CPS_parameters or update_CPS_parameters.
+    tracks (pd.DataFrame): The new TC points. Points of a track must be sorted by time, and later than its previous points.
+    geopt (xr.DataSet): The geopotential snapshots associated with the new points.
+    previous_geopt (xr.DataSet): The geopotential snapshots associated with the rows of previous
+        (e.g. the previous snapshots files concatenated along snapshot, opened lazily).
+        Only the snapshots of the last points of the continuing tracks are read.
+        If None, the B value of these points is not updated.
+    Other parameters: see compute_CPS_parameters.
+
+    Returns
+    -------
+    tracks (pd.DataFrame): The previous rows, updated, followed by the new rows, with a new index.
+        The rows are therefore aligned with the previous snapshots followed by the new ones.
+    """
+    profiler = get_profiler(profiler)
+    tracks = curate_tracks(tracks)
+    if tracks is None:
+        return None
+    previous = previous.copy()
+    keys = ["member", "track_id"] if ("member" in previous.columns and "member" in tracks.columns) else ["track_id"]
+    cols = keys + ["lon", "lat"]
+
+    # Last previous point of the continuing tracks
+    continuing = pd.MultiIndex.from_frame(previous[keys]).isin(pd.MultiIndex.from_frame(tracks[keys]))
+    last = ~previous.duplicated(keys, keep="last").values & continuing
+    revised = np.nonzero(last)[0]
+
+    # theta of the revised and new points, track by track
+    with profiler.stage("theta"):
+        seg = pd.concat([previous.iloc[revised][cols], tracks[cols]], ignore_index=True)
+        seed = np.r_[previous.theta.values[revised], np.full(len(tracks), np.nan)]
+        track = seg.groupby(keys, sort=False).ngroup().values  # Tracks numbered by first appearance
+        order = np.argsort(track, kind="stable")  # Revised point first in each track
+        tid = track[order]
+        th = theta_vector(seg.lon.values[order], seg.lat.values[order], tid)
+        ## A stationnary revised point keeps the direction of the point before, i.e. its previous theta
+        start = np.r_[True, tid[1:] != tid[:-1]]
+        start_idx = np.maximum.accumulate(np.where(start, np.arange(len(tid)), 0))
+        th_sorted = np.where(np.isnan(th), seed[order][start_idx], th)
+        th = np.empty(len(seg))
+        th[order] = th_sorted  # Back to the order of seg
+    previous.iloc[revised, previous.columns.get_loc("theta")] = th[: len(revised)]
+
+    # B of the revised points
+    if len(revised) > 0:
+        if previous_geopt is None:
+            logger.warning("previous_geopt not provided: B is not updated for the last previous point of %d track(s)", len(revised))
+        else:
+            ## Only B changes: only the two levels of B are read
+            with profiler.stage("read"):
+                if grid is None:
+                    grid = PolarGrid.from_dataset(previous_geopt, plev_name, B_levels, VT_levels)
+                z = previous_geopt[geopt_name].rename({plev_name: "plev"})
+                z = z.isel(plev=grid.levels[grid.B_idx], snapshot=revised).load()
+            with profiler.stage("mask"):
+                if dtype is not None and z.dtype != dtype:
+                    z = z.astype(dtype)
+                z = mask_fill_values(z, profiler, inplace=True)  # Freshly loaded
+            with profiler.stage("B"):
+                B = B_vector(
+                    previous.theta.values[revised],
+                    z.isel(plev=0),
+                    z.isel(plev=1),
+                    previous.lat.values[revised],
+                    grid=grid,
+                ).values
+            previous.iloc[revised, previous.columns.get_loc("B")] = B
+
+    # New points
+    new = compute_CPS_parameters(
+        tracks.assign(theta=th[len(revised) :]),
+        geopt,
+        geopt_name=geopt_name,
+        plev_name=plev_name,
+        verbose=verbose,
+        B_levels=B_levels,
+        VT_levels=VT_levels,
+        profiler=profiler,
+        dtype=dtype,
+        grid=grid,
+    )
+
+    return pd.concat([previous, new], ignore_index=True)
 
 
 if __name__ == "__main__":
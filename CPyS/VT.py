@@ -1,8 +1,93 @@
 import numpy as np
 
 
-def VT(geopt, name="snap_zg"):
+def regression_weights(x):
     """
+    Computes the weights giving the least-squares slope of y against x as a dot product.
+
+    Parameters
+    ----------
+    x (np.ndarray): The regressor values
+
+    Returns
+    -------
+    c (np.ndarray): The weights, such that the slope of the regression of y against x is y @ c.
+    """
+    x = np.asarray(x, dtype=float)
+    dx = x - x.mean()
+    return dx / (dx**2).sum()
+
+
+def slopes(x, Y, skipna=False, weights=None):
+    """
+    Computes the least-squares slopes of all the rows of Y against x at once.
+
+    Parameters
+    ----------
+    x (np.ndarray): The regressor values, shared by all the rows
+    Y (np.ndarray): The values to regress, the last dimension corresponding to x
+    skipna (bool): If False, the slope is NaN for rows with missing values.
+        If True, the slope is computed over the available values (NaN if less than two).
+    weights (np.ndarray): The precomputed regression_weights(x), if available.
+
+    Returns
+    -------
+    slopes (np.ndarray): The slope for each row of Y.
+    """
+    x, Y = np.asarray(x, dtype=float), np.asarray(Y, dtype=float)
+    if not skipna:
+        if weights is None:
+            weights = regression_weights(x)
+        return (Y * weights).sum(axis=-1)
+
+    valid = ~np.isnan(Y)
+    n = valid.sum(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dx = np.where(valid, x - (valid * x).sum(axis=-1, keepdims=True) / n, 0)
+        slope = (dx * np.where(valid, Y, 0)).sum(axis=-1) / (dx**2).sum(axis=-1)
+    return np.where(n[..., 0] > 1, slope, np.nan)
+
+
+def VT(geopt, name="snap_zg", skipna=False, levels=(950e2, 600e2, 250e2), grid=None):
+    """
+    Parameters
+    ----------
+    geopt (xr.DataArray) : The Geopotential snapshots DataArray.
+        plev must be decreasing
+        It can have other dimensions than snapshot (e.g. an ensemble member dimension), all computed in one pass.
+    name (str) : Name of the geopotential snapshots variable.
+    skipna (bool) : If False, VTL and VTU are NaN for snapshots with a missing level.
+        If True, they are computed from the available levels.
+    levels (tuple) : Bottom, middle and top levels (in Pa) of the lower and upper layers.
+    grid (PolarGrid) : The precomputed geometry of the snapshots, see CPyS.grid. If provided, its levels are used.
+
+    Returns
+    -------
+    VTL, VTU : The Hart Phase Space parameters for upper and lower thermal wind respectively,
+        with the dimensions of geopt other than plev, r and az (in the order of geopt).
+    """
+    Z_max = geopt[name].max(["az", "r"])  # Maximum of Z at each level for each snapshot
+    Z_min = geopt[name].min(["az", "r"])  # Minimum of ...
+    ΔZ = Z_max - Z_min  # Fonction of snapshot & plev
+    if grid is not None:
+        if not np.array_equal(ΔZ.plev.values, grid.plev):
+            ΔZ = ΔZ.sel(plev=grid.plev)
+        ΔZ = ΔZ.transpose(..., "plev").values
+        x = np.log(grid.plev)
+        VTL = slopes(x[grid.VT_bottom], ΔZ[..., grid.VT_bottom], skipna, grid.VTL_weights)
+        VTU = slopes(x[grid.VT_top], ΔZ[..., grid.VT_top], skipna, grid.VTU_weights)
+        return VTL, VTU
+    ΔZ_bottom = ΔZ.sel(plev=slice(levels[0], levels[1]))  # Lower troposphere
+    ΔZ_top = ΔZ.sel(plev=slice(levels[1], levels[2]))  # Upper tropo
+    VTL = slopes(np.log(ΔZ_bottom.plev.values), ΔZ_bottom.transpose(..., "plev").values, skipna)
+    VTU = slopes(np.log(ΔZ_top.plev.values), ΔZ_top.transpose(..., "plev").values, skipna)
+    return VTL, VTU
+
+
+def VT_linregress(geopt, name="snap_zg"):
+    """
+    Reference implementation of VT, with one scipy regression per snapshot.
+
     Parameters
     ----------
     geopt (xr.DataArray) : The Geopotential snapshots DataArray.
@@ -1,7 +1,23 @@
+__version__ = "0.0.6"
+
 import numpy as np
 import pandas as pd
 import xarray as xr
 
-from .CPS import compute_CPS_parameters
+from .CPS import compute_CPS_parameters, iter_CPS_parameters, update_CPS_parameters
+from .batch import compute_CPS_batch
+from .cache import ResultCache
+from .grid import PolarGrid
+from .index import SnapshotIndex
+from .phase import compute_phases, transition_times
+from .snapshots import extract_snapshots
 from .theta import theta_multitrack
-from .plot import *
+
+
+def __getattr__(name):
+    # matplotlib is only imported when plotting, so that the computation does not depend on it
+    if name in ("plot_CPS", "plot_CPS_density", "plot_CPS_batch"):
+        from . import plot
+
+        return getattr(plot, name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
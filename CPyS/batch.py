@@ -0,0 +1,154 @@
+import concurrent.futures
+import logging
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .CPS import compute_CPS_parameters
+from .profiling import logger
+
+
+def read_manifest(manifest):
+    """
+    Reads the list of (tracks, snapshots) inputs of a batch.
+
+    Parameters
+    ----------
+    manifest: Either a list of (tracks, snapshots) pairs of file paths,
+        a pd.DataFrame with columns "tracks" and "snapshots",
+        or the path to a csv file with these columns.
+
+    Returns
+    -------
+    items (list): The list of (tracks, snapshots) pairs.
+    """
+    if type(manifest) == str:
+        manifest = pd.read_csv(manifest, index_col=False)
+    if type(manifest) == pd.DataFrame:
+        return list(zip(manifest.tracks, manifest.snapshots))
+    return [tuple(item) for item in manifest]
+
+
+def snapshot_count(snapshots):
+    """
+    Number of snapshots in a snapshots file, read from the metadata only.
+    Returns 0 if the file cannot be opened, so that the error is reported when the item is processed.
+    """
+    try:
+        with xr.open_dataset(snapshots) as geopt:
+            return geopt.sizes["snapshot"]
+    except Exception:
+        return 0
+
+
+def compute_pair(tracks, snapshots, **kwargs):
+    """
+    Computes the CPS parameters for one (tracks, snapshots) pair of files.
+
+    Parameters
+    ----------
+    tracks (str): Path to the tracks csv file (e.g. StitchNodes output)
+    snapshots (str): Path to the snapshots NetCDF file (e.g. NodeFileCompose output)
+    **kwargs: Passed to compute_CPS_parameters
+
+    Returns
+    -------
+    tracks (pd.DataFrame): The set of TC points with the CPS parameters
+    """
+    tracks = pd.read_csv(tracks, index_col=False)
+    with xr.open_dataset(snapshots) as geopt:
+        return compute_CPS_parameters(tracks, geopt, verbose=False, **kwargs)
+
+
+def compute_CPS_batch(
+    manifest,
+    max_workers=None,
+    retries=1,
+    geopt_name="snap_zg",
+    plev_name="level",
+    chunk_size=None,
+    verbose=True,
+):
+    """
+    Computes the CPS parameters for many (tracks, snapshots) pairs of files in parallel.
+    The items are distributed over a pool of processes, largest (in number of snapshots) first,
+    so that the workers finish at about the same time.
+    Items that fail are retried alone, each in its own process, up to `retries` times,
+    so that an item crashing its worker (which breaks the whole pool) does not make the other items fail.
+
+    Parameters
+    ----------
+    manifest: The (tracks, snapshots) inputs, see read_manifest.
+    max_workers (int): Number of processes. Defaults to the number of CPUs.
+    retries (int): Number of times a failed item is retried alone.
+        Items failing because another item broke the pool are retried at least once.
+    geopt_name (str): Name of the 3D (plev, r, az) geopt snapshots variable.
+    plev_name (str): name of the vertical coordinate in the geopt files.
+    chunk_size (int): If provided, each worker processes its snapshots by chunks of this size.
+    verbose (bool): Log the progress at INFO level on the "CPyS" logger (DEBUG level otherwise).
+        Items which still fail are logged as warnings in any case.
+
+    Returns
+    -------
+    tracks (pd.DataFrame): The points of all the items with their CPS parameters,
+        with a column "item" giving the position of the item in the manifest.
+        Items which still fail after the retries are logged and left out.
+    """
+    items = read_manifest(manifest)
+    sizes = np.array([snapshot_count(snapshots) for tracks, snapshots in items])
+    kwargs = dict(geopt_name=geopt_name, plev_name=plev_name, chunk_size=chunk_size)
+
+    results, errors = {}, {}
+    level = logging.INFO if verbose else logging.DEBUG
+
+    def done(i):
+        logger.log(level, "Done %d/%d: %s", len(results), len(items), items[i][1])
+
+    # All the items in one pool, largest first
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+        futures = {
+            pool.submit(compute_pair, *items[i], **kwargs): i
+            for i in np.argsort(-sizes, kind="stable")
+        }
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+            else:
+                done(i)
+
+    # Failed items are retried alone, each in its own process: a crashing worker breaks the whole pool,
+    # so the items failing with BrokenProcessPool are retried at least once, and an item only fails when it fails alone.
+    def retry(i):
+        attempts = max(retries, 1) if isinstance(errors[i], BrokenProcessPool) else retries
+        error = errors[i]
+        for attempt in range(attempts):
+            with concurrent.futures.ProcessPoolExecutor(1) as pool:
+                try:
+                    return i, pool.submit(compute_pair, *items[i], **kwargs).result(), None
+                except Exception as e:
+                    error = e
+        return i, None, error
+
+    remaining = sorted(errors, key=lambda i: -sizes[i])
+    if len(remaining) > 0:
+        logger.log(level, "Retrying %d failed item(s) alone...", len(remaining))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as threads:
+        for i, result, error in threads.map(retry, remaining):
+            if error is None:
+                results[i] = result
+                del errors[i]
+                done(i)
+            else:
+                errors[i] = error
+
+    for i in sorted(errors):
+        logger.warning("Failed: %s: %r", items[i], errors[i])
+
+    if len(results) == 0:
+        return None
+    return pd.concat([results[i].assign(item=i) for i in sorted(results)])
@@ -0,0 +1,157 @@
+import collections
+import glob
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+def hash_arrays(*arrays):
+    """
+    Hash of the content of a sequence of arrays (or other objects, hashed from their repr).
+
+    Returns
+    -------
+    key (str): Hexadecimal digest.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for a in arrays:
+        if isinstance(a, np.ndarray):
+            if a.dtype == object:
+                a = pd.util.hash_array(a)  # Strings, ...
+            h.update(str((a.dtype, a.shape)).encode())
+            h.update(np.ascontiguousarray(a).tobytes())
+        else:
+            h.update(repr(a).encode())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+def file_fingerprint(source):
+    """
+    Fingerprint of snapshots files from their path, size and modification time, without reading them.
+
+    Parameters
+    ----------
+    source (str or list): A file, a Zarr store (directory), a list of files or a glob pattern.
+
+    Returns
+    -------
+    fingerprint (list): (path, size, mtime) of each file.
+    """
+    if isinstance(source, (list, tuple)):
+        paths = [str(p) for p in source]
+    else:
+        paths = sorted(glob.glob(str(source))) if glob.has_magic(str(source)) else [str(source)]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):  # Zarr store
+            files += sorted(os.path.join(d, f) for d, _, names in os.walk(path) for f in names)
+        else:
+            files.append(path)
+    fingerprint = []
+    for f in files:
+        stat = os.stat(f)
+        fingerprint.append((os.path.abspath(f), stat.st_size, stat.st_mtime_ns))
+    return fingerprint
+
+
+class ResultCache:
+    """
+    Persistent on-disk cache of the CPS parameters computed for each chunk of snapshots,
+    addressed by the hash of the inputs of the chunk (see iter_CPS_parameters), so that unchanged chunks are not recomputed.
+    Each entry is a .npz file; when the cache exceeds max_size, the least recently used entries are removed.
+
+    Parameters
+    ----------
+    directory (str): The directory of the cache, created if needed.
+    max_size (float): Maximum size of the cache, in bytes.
+    """
+
+    def __init__(self, directory, max_size=1e9):
+        self.directory = str(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        self._entries = None  # path -> size, least recently used first, listed once
+        self._total = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _load_entries(self):
+        if self._entries is None:
+            self._entries = collections.OrderedDict((path, size) for mtime, size, path in self.entries())
+            self._total = sum(self._entries.values())
+        return self._entries
+
+    def get(self, key):
+        """
+        Returns the arrays stored for key, or None if they are not in the cache.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+        os.utime(path)  # Most recently used
+        if self._entries is not None and path in self._entries:
+            self._entries.move_to_end(path)
+        return arrays
+
+    def put(self, key, **arrays):
+        """
+        Stores the arrays for key, then evicts the least recently used entries if the cache exceeds max_size.
+        The size of the cache is kept up to date in memory, so that the directory is only listed once,
+        and again when the limit is exceeded (to take other processes writing to the cache into account).
+        """
+        entries = self._load_entries()
+        path = self.path(key)
+        tmp = path + "." + str(os.getpid()) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)  # Atomic, for concurrent runs
+        self._total += size - entries.pop(path, 0)
+        entries[path] = size
+        if self._total > self.max_size:
+            self.evict()
+
+    def entries(self):
+        """
+        (mtime, size, path) of the entries on disk, least recently used first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_size.
+        """
+        self._entries = None  # Listed again from the disk
+        entries = self._load_entries()
+        while self._total > self.max_size and len(entries) > 0:
+            path, size = entries.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._total -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            os.remove(path)
+        self._entries, self._total = None, 0
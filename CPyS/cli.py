@@ -0,0 +1,147 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import pandas as pd
+
+from .CPS import iter_CPS_parameters
+
+
+class ParquetWriter:
+    """
+    Writes consecutive chunks of a DataFrame to a Parquet file, one row group per chunk.
+    The schema is set by the first chunk.
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow: `pip install pyarrow`")
+        self.pa, self.pq = pa, pq
+        self.path = path
+        self.writer = None
+
+    def write(self, df):
+        if self.writer is None:
+            table = self.pa.Table.from_pandas(df, preserve_index=False)
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = self.pa.Table.from_pandas(
+                df, schema=self.writer.schema, preserve_index=False
+            )
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class NetCDFWriter:
+    """
+    Writes consecutive chunks of a DataFrame to a NetCDF file, along an unlimited "record" dimension.
+    Numerical columns are stored as such, other columns as strings. The variables are set by the first chunk.
+    """
+
+    def __init__(self, path):
+        try:
+            import netCDF4
+        except ImportError:
+            raise ImportError("Writing NetCDF files requires netCDF4: `pip install netCDF4`")
+        self.nc = netCDF4.Dataset(path, "w")
+        self.nc.createDimension("record", None)
+        self.n = 0
+
+    def write(self, df):
+        if len(self.nc.variables) == 0:
+            for col in df.columns:
+                values = df[col].to_numpy()
+                if values.dtype.kind in "iuf":
+                    self.nc.createVariable(col, values.dtype, ("record",))
+                else:
+                    self.nc.createVariable(col, str, ("record",))
+        for col in df.columns:
+            values = df[col].to_numpy()
+            if self.nc[col].dtype == str:
+                values = df[col].astype(str).values.astype(object)
+            self.nc[col][self.n : self.n + len(df)] = values
+        self.n += len(df)
+
+    def close(self):
+        self.nc.close()
+
+
+def open_writer(path, fmt=None):
+    """
+    Opens a writer for the output file, in the format given by fmt or by the extension of path.
+    """
+    if fmt is None:
+        fmt = "netcdf" if os.path.splitext(path)[1] in [".nc", ".nc4"] else "parquet"
+    if fmt == "parquet":
+        return ParquetWriter(path)
+    elif fmt == "netcdf":
+        return NetCDFWriter(path)
+    raise ValueError("Unknown output format: " + str(fmt))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="cpys",
+        description="Computes the Hart Cyclone Phase Space parameters (theta, B, VTL, VTU) along tracks.",
+    )
+    parser.add_argument("tracks", help="Tracks csv file (e.g. from StitchNodes)")
+    parser.add_argument("snapshots", nargs="+", help="Snapshots NetCDF file(s) (e.g. from NodeFileCompose), concatenated along snapshot, or Zarr store")
+    parser.add_argument("-o", "--output", required=True, help="Output file (.parquet or .nc)")
+    parser.add_argument("--format", choices=["parquet", "netcdf"], help="Output format (default: from the output extension)")
+    parser.add_argument("--geopt-name", default="snap_zg", help="Name of the geopt snapshots variable (default: snap_zg)")
+    parser.add_argument("--plev-name", default="level", help="Name of the vertical coordinate, in Pa (default: level)")
+    parser.add_argument("--B-levels", nargs=2, type=float, default=[900, 600], metavar=("LOWER", "UPPER"), help="Levels of the thickness used for B, in hPa (default: 900 600)")
+    parser.add_argument("--VT-levels", nargs=3, type=float, default=[950, 600, 250], metavar=("BOTTOM", "MIDDLE", "TOP"), help="Levels of the layers used for VTL and VTU, in hPa (default: 950 600 250)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Number of snapshots processed at once (default: 1000)")
+    parser.add_argument("--no-prefetch", action="store_true", help="Do not read the next chunk while the current one is computed")
+    parser.add_argument("--cache", help="Directory of a cache of the results of each chunk, reused by later runs")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the final throughput")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO, format="%(message)s")
+    start = time.perf_counter()
+
+    tracks = pd.read_csv(args.tracks, index_col=False)
+    writer = open_writer(args.output, args.format)
+    n = 0
+    try:
+        snapshots = args.snapshots[0] if len(args.snapshots) == 1 else args.snapshots
+        for chunk in iter_CPS_parameters(
+            tracks,
+            snapshots,  # Opened, fingerprinted for the cache and closed by iter_CPS_parameters
+            geopt_name=args.geopt_name,
+            plev_name=args.plev_name,
+            chunk_size=args.chunk_size,
+            verbose=not args.quiet,
+            B_levels=tuple(l * 100 for l in args.B_levels),
+            VT_levels=tuple(l * 100 for l in args.VT_levels),
+            prefetch=not args.no_prefetch,
+            cache=args.cache,
+        ):
+            writer.write(chunk)
+            n += len(chunk)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        "Processed " + str(n) + " points in " + "{:.2f}".format(elapsed) + " s ("
+        + "{:.1f}".format(n / elapsed) + " points/s)",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from .B import area_weights
+from .VT import regression_weights
+
+
+def needed_levels(plev, B_levels=(900e2, 600e2), VT_levels=(950e2, 600e2, 250e2)):
+    """
+    Selects the levels used by B and VT, so that the other levels are never read.
+
+    Parameters
+    ----------
+    plev (np.ndarray): The levels of the snapshots (in Pa), monotonic
+    B_levels (tuple): Lower and upper levels (in Pa) of the thickness used for B.
+    VT_levels (tuple): Bottom, middle and top levels (in Pa) of the layers used for VTL and VTU.
+
+    Returns
+    -------
+    idx (np.ndarray): Indices of the needed levels, by decreasing pressure.
+    """
+    plev = np.asarray(plev)
+    keep = (plev <= VT_levels[0]) & (plev >= VT_levels[2])
+    keep[pd.Index(plev).get_indexer(list(B_levels), method="nearest")] = True  # Same as sel(method="nearest")
+    idx = np.nonzero(keep)[0]
+    return idx[np.argsort(-plev[idx], kind="stable")]
+
+
+class PolarGrid:
+    """
+    Geometry of the (plev, r, az) snapshots grid, with everything B and VT need that does not depend on the data.
+    Build it once (e.g. with PolarGrid.from_dataset) and pass it to compute_CPS_parameters, B_vector or VT
+    to skip this setup for each file on the same grid.
+
+    Parameters
+    ----------
+    plev (np.ndarray): The levels of the snapshots (in Pa), monotonic
+    r (np.ndarray): The radii of the snapshots
+    az (np.ndarray): The azimuths of the snapshots (in degrees), increasing
+    B_levels (tuple): Lower and upper levels (in Pa) of the thickness used for B.
+    VT_levels (tuple): Bottom, middle and top levels (in Pa) of the layers used for VTL and VTU.
+
+    Attributes
+    ----------
+    levels (np.ndarray): Indices of the levels used, by decreasing pressure (see needed_levels)
+    plev (np.ndarray): The levels used, by decreasing pressure. The indices below refer to these levels.
+    B_idx (np.ndarray): Indices of the lower and upper levels used for B
+    VT_bottom, VT_top (np.ndarray): Indices of the levels of the lower and upper layers used for VTL and VTU
+    VTL_weights, VTU_weights (np.ndarray): The regression weights against log(plev) over each layer
+    weights (np.ndarray): The area weights of the radii
+    """
+
+    def __init__(self, plev, r, az, B_levels=(900e2, 600e2), VT_levels=(950e2, 600e2, 250e2)):
+        self.full_plev = np.asarray(plev)
+        self.r, self.az = np.asarray(r, dtype=float), np.asarray(az, dtype=float)
+        assert (np.diff(self.az) > 0).all(), "az must be increasing"
+        self.B_levels, self.VT_levels = tuple(B_levels), tuple(VT_levels)
+
+        # Levels
+        self.levels = needed_levels(self.full_plev, B_levels, VT_levels)
+        self.plev = self.full_plev[self.levels]
+        B_full = pd.Index(self.full_plev).get_indexer(list(B_levels), method="nearest")
+        self.B_idx = np.array([np.nonzero(self.levels == i)[0][0] for i in B_full])
+        self.VT_bottom = np.nonzero((self.plev <= VT_levels[0]) & (self.plev >= VT_levels[1]))[0]
+        self.VT_top = np.nonzero((self.plev <= VT_levels[1]) & (self.plev >= VT_levels[2]))[0]
+
+        # Regression weights
+        self.VTL_weights = regression_weights(np.log(self.plev[self.VT_bottom]))
+        self.VTU_weights = regression_weights(np.log(self.plev[self.VT_top]))
+
+        # Radial weights
+        self.weights = np.asarray(area_weights(self))
+
+    @classmethod
+    def from_dataset(cls, geopt, plev_name="level", B_levels=(900e2, 600e2), VT_levels=(950e2, 600e2, 250e2)):
+        """
+        Builds the grid from the coordinates of a snapshots Dataset or DataArray.
+        """
+        return cls(geopt[plev_name].values, geopt.r.values, geopt.az.values, B_levels, VT_levels)
+
+    def check(self, geopt, plev_name="level"):
+        """
+        Raises a ValueError if the coordinates of geopt do not match the grid.
+        """
+        for name, values in [(plev_name, self.full_plev), ("r", self.r), ("az", self.az)]:
+            if not np.array_equal(geopt[name].values, values):
+                raise ValueError("The " + name + " coordinate of the snapshots does not match the PolarGrid.")
+
+    def snap(self, th):
+        """
+        Index of the nearest azimuth to each direction, as az.sel(az=th, method="nearest").
+
+        Parameters
+        ----------
+        th (np.ndarray): The directions (in degrees)
+
+        Returns
+        -------
+        idx (np.ndarray): The indices in az
+        """
+        th = np.asarray(th, dtype=float)
+        n = len(self.az)
+        right = np.searchsorted(self.az, th, side="left")  # First az >= th
+        left = np.maximum(np.searchsorted(self.az, th, side="right") - 1, 0)  # Last az <= th
+        right_c = np.minimum(right, n - 1)
+        use_left = (np.abs(self.az[left] - th) < np.abs(self.az[right_c] - th)) | (right == n)
+        return np.where(use_left, left, right_c)
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+from .profiling import logger
+
+
+def check_alignment(tracks, geopt, time_name="snap_time"):
+    """
+    Checks that the points of tracks correspond, in order, to the snapshots of geopt,
+    from the time of the snapshots when it is available (e.g. snap_time in NodeFileCompose outputs).
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The set of TC points
+    geopt (xr.DataSet): The snapshots
+    time_name (str): Name of the time of the snapshots.
+
+    Raises
+    ------
+    ValueError: If tracks has more points than snapshots, or if the times differ.
+    Only the number of points is checked (with a warning) if geopt has no time.
+    """
+    if len(tracks) > geopt.sizes["snapshot"]:
+        raise ValueError(
+            "tracks has " + str(len(tracks)) + " points but there are only "
+            + str(geopt.sizes["snapshot"]) + " snapshots."
+        )
+    if time_name not in geopt.variables or geopt[time_name].dtype.kind != "M":
+        logger.warning("The snapshots have no %s: cannot check that they are aligned with the tracks.", time_name)
+        return
+    snap_time = geopt[time_name].values[: len(tracks)]
+    mismatch = np.flatnonzero(pd.to_datetime(tracks.time).values != snap_time)
+    if len(mismatch) > 0:
+        raise ValueError(
+            str(len(mismatch)) + " points of tracks do not match the time of their snapshot (first: point "
+            + str(mismatch[0]) + " at " + str(tracks.time.iloc[mismatch[0]]) + ", snapshot at "
+            + str(snap_time[mismatch[0]]) + "). Use a SnapshotIndex to select the snapshots of a subset of points."
+        )
+
+
+class SnapshotIndex:
+    """
+    Position of the snapshot of each (track_id, time) point, so that the parameters can be computed
+    for any subset of points (e.g. one basin or one storm), in any order, reading only their snapshots.
+    Build it once from the full tracks file matching the snapshots file (see from_tracks), and keep it
+    as a sidecar file (see save and load) or attached to the snapshots Dataset (see attach and from_dataset).
+
+    Parameters
+    ----------
+    track_id (np.ndarray): The track of each snapshot
+    time (np.ndarray): The time of each snapshot
+    """
+
+    def __init__(self, track_id, time):
+        self.keys = pd.MultiIndex.from_arrays(
+            [np.asarray(track_id), pd.to_datetime(np.asarray(time))], names=["track_id", "time"]
+        )
+        if not self.keys.is_unique:
+            raise ValueError("The (track_id, time) pairs of the snapshots are not unique.")
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_tracks(cls, tracks, geopt=None):
+        """
+        Index of snapshots whose i-th snapshot corresponds to the i-th point of tracks,
+        checked against the time of the snapshots of geopt if provided (see check_alignment).
+        """
+        if geopt is not None:
+            check_alignment(tracks, geopt)
+        return cls(tracks.track_id.values, tracks.time.values)
+
+    @classmethod
+    def from_dataset(cls, geopt):
+        """
+        Index attached to a snapshots Dataset with attach.
+        """
+        return cls(geopt.snap_track_id.values, geopt.snap_time.values)
+
+    def attach(self, geopt):
+        """
+        Attaches the index to a snapshots Dataset, as the snap_track_id and snap_time variables.
+        """
+        if len(self) != geopt.sizes["snapshot"]:
+            raise ValueError("The index has " + str(len(self)) + " snapshots, geopt has " + str(geopt.sizes["snapshot"]) + ".")
+        return geopt.assign(
+            snap_track_id=("snapshot", self.keys.get_level_values(0).values),
+            snap_time=("snapshot", self.keys.get_level_values(1).values),
+        )
+
+    def save(self, path):
+        """
+        Writes the index to a sidecar .npz file, e.g. next to the snapshots file.
+        """
+        track_id = self.keys.get_level_values(0).values
+        if track_id.dtype == object:
+            track_id = track_id.astype(str)
+        np.savez(path, track_id=track_id, time=self.keys.get_level_values(1).values)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index written with save.
+        """
+        with np.load(path) as f:
+            return cls(f["track_id"], f["time"])
+
+    def positions(self, tracks):
+        """
+        Positions of the snapshots of the points of tracks.
+
+        Raises
+        ------
+        ValueError: If some points are not in the index.
+        """
+        keys = pd.MultiIndex.from_arrays([tracks.track_id.values, pd.to_datetime(tracks.time).values])
+        positions = self.keys.get_indexer(keys)
+        missing = np.flatnonzero(positions < 0)
+        if len(missing) > 0:
+            raise ValueError(
+                str(len(missing)) + " points of tracks are not in the snapshots index (first: track "
+                + str(tracks.track_id.iloc[missing[0]]) + " at " + str(tracks.time.iloc[missing[0]]) + ")."
+            )
+        return positions
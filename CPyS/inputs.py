@@ -0,0 +1,94 @@
+import glob
+
+import xarray as xr
+
+
+def open_snapshots(source, geopt_name="snap_zg", **kwargs):
+    """
+    Opens snapshots lazily, from a NetCDF file, a Zarr store, or a collection of NetCDF files.
+
+    Parameters
+    ----------
+    source: Either
+        * an xr.Dataset, returned as is;
+        * the path to a Zarr store (ending with .zarr), opened without dask;
+        * a list of paths or a glob pattern, opened with xr.open_mfdataset (requires dask),
+          concatenated along snapshot in the order of the list (sorted for a pattern),
+          keeping only the geopt_name variable (and snap_time and snap_track_id, see CPyS.index);
+        * the path to a NetCDF file.
+    geopt_name (str): Name of the 3D (plev, r, az) geopt snapshots variable.
+    **kwargs: Passed to the xarray opening function.
+
+    Returns
+    -------
+    geopt (xr.Dataset): The snapshots, opened lazily.
+    """
+    if isinstance(source, xr.Dataset):
+        return source
+    if isinstance(source, (list, tuple)) or glob.has_magic(str(source)):
+        return xr.open_mfdataset(
+            source,
+            combine="nested",
+            concat_dim="snapshot",
+            data_vars="minimal",
+            coords="minimal",
+            compat="override",
+            preprocess=lambda ds: ds[[v for v in [geopt_name, "snap_time", "snap_track_id"] if v in ds.variables]],
+            **kwargs
+        )
+    if str(source).rstrip("/").endswith(".zarr"):
+        return xr.open_dataset(source, engine="zarr", chunks=None, **kwargs)
+    return xr.open_dataset(source, **kwargs)
+
+
+def snapshot_chunks(geopt, geopt_name="snap_zg"):
+    """
+    Sizes of the chunks of the snapshots variable along snapshot, from its dask chunks
+    or from its chunking on disk (Zarr or NetCDF4).
+
+    Returns
+    -------
+    chunks (tuple): The size of each chunk, or None if the variable is not chunked.
+    """
+    z = geopt[geopt_name]
+    axis = z.dims.index("snapshot")
+    if z.chunks is not None:
+        return tuple(z.chunks[axis])
+    size = z.encoding.get("preferred_chunks", {}).get("snapshot")
+    if size is None and z.encoding.get("chunksizes") is not None:
+        size = z.encoding["chunksizes"][axis]
+    if size is None:
+        return None
+    n = z.sizes["snapshot"]
+    return (size,) * (n // size) + ((n % size,) if n % size else ())
+
+
+def chunk_bounds(n, chunk_size, chunks=None):
+    """
+    Bounds of the chunks of snapshots to process.
+    When the chunks on disk are known, each processing chunk is made of whole chunks on disk,
+    of at least chunk_size snapshots, so that each chunk on disk is decoded only once.
+
+    Parameters
+    ----------
+    n (int): Number of snapshots
+    chunk_size (int): Target number of snapshots of each chunk
+    chunks (tuple): The sizes of the chunks on disk, see snapshot_chunks.
+
+    Returns
+    -------
+    bounds (list): (start, stop) of each chunk.
+    """
+    if chunks is None:
+        return [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    bounds, start, stop = [], 0, 0
+    for size in chunks:
+        stop = min(stop + size, n)
+        if stop - start >= chunk_size or stop == n:
+            bounds.append((start, stop))
+            start = stop
+        if stop == n:
+            break
+    if start < n:
+        bounds.append((start, n))
+    return bounds
@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+
+
+def track_starts(tracks):
+    """
+    Finds the first point of each track in a flat set of tracks, without grouping.
+    The points of each track must be contiguous and sorted by time.
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The set of TC points, with a track_id column
+        (and a member column for ensembles, the tracks being identified by member and track_id).
+
+    Returns
+    -------
+    start (np.ndarray): Boolean array, True for the first point of each track.
+    """
+    start = np.zeros(len(tracks), dtype=bool)
+    start[:1] = True
+    for key in ["member", "track_id"]:
+        if key in tracks.columns:
+            values = tracks[key].values
+            start[1:] |= values[1:] != values[:-1]
+    return start
+
+
+def running_mean(x, time, start, window=24):
+    """
+    Centred running mean within each track, over a time window, ignoring missing values.
+    The window is truncated at the ends of the tracks.
+    Uses cumulated sums over the flat array, so that the cost does not depend on the number of tracks.
+
+    Parameters
+    ----------
+    x (np.ndarray): The values for each point
+    time (np.ndarray): The time of each point (datetime64), sorted within each track
+    start (np.ndarray): True for the first point of each track, see track_starts.
+    window (float): Width of the window, in hours.
+
+    Returns
+    -------
+    mean (np.ndarray): The running mean for each point (NaN if the window has no valid value).
+    """
+    x = np.asarray(x, dtype=float)
+    seconds = np.asarray(time, dtype="datetime64[s]").astype(np.int64)
+    seconds = seconds - seconds.min() if len(seconds) else seconds
+    half = int(round(window * 3600 / 2))
+
+    # Monotonic key: tracks are separated by more than the window, so that the window never crosses tracks
+    track = np.cumsum(start)
+    key = track * (seconds.max(initial=0) + 2 * half + 1) + seconds
+    lo = np.searchsorted(key, key - half, side="left")
+    hi = np.searchsorted(key, key + half, side="right")
+
+    valid = ~np.isnan(x)
+    total = np.concatenate([[0], np.cumsum(np.where(valid, x, 0))])
+    count = np.concatenate([[0], np.cumsum(valid)])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count[hi] > count[lo], (total[hi] - total[lo]) / (count[hi] - count[lo]), np.nan)
+
+
+def classify(B, VTL, B_threshold=10):
+    """
+    Classifies points in the phase space:
+        * SWC: Symmetric warm core (B < B_threshold, VTL > 0), e.g. tropical cyclones
+        * SCC: Symmetric cold core (B < B_threshold, VTL <= 0)
+        * AWC: Asymmetric warm core (B >= B_threshold, VTL > 0), e.g. undergoing extratropical transition
+        * ACC: Asymmetric cold core (B >= B_threshold, VTL <= 0), e.g. extratropical cyclones
+
+    Parameters
+    ----------
+    B (np.ndarray): The B parameter for each point
+    VTL (np.ndarray): The VTL parameter for each point
+    B_threshold (float): Threshold of B separating symmetric and asymmetric (frontal) structures.
+
+    Returns
+    -------
+    phase (np.ndarray): The phase of each point, "" if B or VTL is missing.
+    """
+    B, VTL = np.asarray(B, dtype=float), np.asarray(VTL, dtype=float)
+    asymmetric, warm = B >= B_threshold, VTL > 0
+    phase = np.select(
+        [~asymmetric & warm, ~asymmetric & ~warm, asymmetric & warm, asymmetric & ~warm],
+        ["SWC", "SCC", "AWC", "ACC"],
+        default="",
+    )
+    phase[np.isnan(B) | np.isnan(VTL)] = ""
+    return phase
+
+
+def first_crossing(condition, start):
+    """
+    Position of the first point of each track where condition is True.
+
+    Parameters
+    ----------
+    condition (np.ndarray): Boolean array over all the points
+    start (np.ndarray): True for the first point of each track, see track_starts.
+
+    Returns
+    -------
+    idx (np.ndarray): For each track, the position of its first point satisfying condition, -1 if there is none.
+    """
+    n = len(condition)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    idx = np.minimum.reduceat(np.where(condition, np.arange(n), n), np.flatnonzero(start))
+    return np.where(idx < n, idx, -1)
+
+
+def compute_phases(tracks, window=24, B_threshold=10, params=("B", "VTL", "VTU")):
+    """
+    Smooths the CPS parameters with a centred running mean along each track and classifies each point,
+    for all the tracks at once.
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The output of compute_CPS_parameters.
+        The points of each track must be contiguous and sorted by time.
+    window (float): Width of the running mean, in hours (24h in Hart, 2003).
+    B_threshold (float): Threshold of B separating symmetric and asymmetric structures.
+    params (tuple): The parameters to smooth.
+
+    Returns
+    -------
+    tracks (pd.DataFrame): The set of TC points with the smoothed parameters (<param>_smooth columns)
+        and the phase of each point from the smoothed B and VTL (phase column, see classify).
+    """
+    start = track_starts(tracks)
+    time = pd.to_datetime(tracks.time).values
+    smooth = {p + "_smooth": running_mean(tracks[p].values, time, start, window) for p in params}
+    return tracks.assign(**smooth, phase=classify(smooth["B_smooth"], smooth["VTL_smooth"], B_threshold))
+
+
+def transition_times(tracks, B_threshold=10):
+    """
+    Finds the extratropical transition of each track, for all the tracks at once:
+        * onset: first time B reaches B_threshold, i.e. the first asymmetric point (see classify)
+        * completion: first cold core point (VTL <= 0, see classify), from the onset on
+    Uses the smoothed parameters if available (see compute_phases).
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The output of compute_CPS_parameters or compute_phases.
+        The points of each track must be contiguous and sorted by time.
+    B_threshold (float): Threshold of B for the onset.
+
+    Returns
+    -------
+    transitions (pd.DataFrame): One row per track, with the track identifiers, and the onset
+        and completion times (NaT if the transition does not start or does not complete).
+    """
+    B = tracks["B_smooth" if "B_smooth" in tracks.columns else "B"].values
+    VTL = tracks["VTL_smooth" if "VTL_smooth" in tracks.columns else "VTL"].values
+    time = pd.to_datetime(tracks.time).values
+    start = track_starts(tracks)
+
+    onset = first_crossing(B >= B_threshold, start)  # Same comparison as classify
+    after_onset = np.arange(len(tracks)) >= np.repeat(
+        np.where(onset >= 0, onset, len(tracks)), np.diff(np.append(np.flatnonzero(start), len(tracks)))
+    )
+    completion = first_crossing((VTL <= 0) & after_onset, start)  # Cold core, as in classify
+
+    keys = [k for k in ["member", "track_id"] if k in tracks.columns]
+    transitions = tracks[keys].iloc[np.flatnonzero(start)].reset_index(drop=True)
+    return transitions.assign(
+        onset=np.where(onset >= 0, time[onset], np.datetime64("NaT")),
+        completion=np.where(completion >= 0, time[completion], np.datetime64("NaT")),
+    )
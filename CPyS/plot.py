@@ -1,13 +1,24 @@
+import concurrent.futures
+import os
+
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+
+from .phase import track_starts
 
 
-def plot_CPS(tracks, title=""):
-    fig, axs = plt.subplots(1, 2, figsize=[10, 5])
-    fig.suptitle(title)
+def draw_axes(axs):
+    """
+    Draws the reference lines and labels of the two phase space diagrams.
 
+    Parameters
+    ----------
+    axs: The two axes (B vs. VTL, VTU vs. VTL)
+    """
     # Left plot (B vs. VTL)
-    ## Data
-    axs[0].plot(tracks.VTL, tracks.B, marker="o", color="k")
     ## x-axis
     axs[0].axvline(x=0, color="k", alpha=0.5, linestyle="--", linewidth=1)
     axs[0].set_xlabel("$-V_T^L$ / m")
@@ -16,8 +27,6 @@ def plot_CPS(tracks, title=""):
     axs[0].set_ylabel("B / m")
 
     # Right plot (VTU vs. VTL)
-    ## Data
-    axs[1].plot(tracks.VTL, tracks.VTU, marker="o", color="k")
     ## x-axis
     axs[1].axvline(x=0, color="k", alpha=0.5, linestyle="--", linewidth=1)
     axs[1].set_xlabel("$-V_T^L$ / m")
@@ -25,5 +34,160 @@ def plot_CPS(tracks, title=""):
     axs[1].axhline(y=0, color="k", alpha=0.5, linestyle="--", linewidth=1)
     axs[1].set_ylabel("$-V_T^U$ / m")
 
-    plt.tight_layout()
-    plt.show()
+
+def plot_CPS(tracks, title="", axs=None, show=True):
+    """
+    Plots the two phase space diagrams of a track.
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The points of the track, with the CPS parameters.
+    title (str): Title of the figure.
+    axs: Two axes to draw on. By default, a new figure is created.
+    show (bool): Call plt.show() at the end.
+
+    Returns
+    -------
+    axs: The two axes.
+    """
+    if axs is None:
+        fig, axs = plt.subplots(1, 2, figsize=[10, 5])
+        fig.suptitle(title)
+
+    ## Data
+    axs[0].plot(tracks.VTL, tracks.B, marker="o", color="k")
+    axs[1].plot(tracks.VTL, tracks.VTU, marker="o", color="k")
+    draw_axes(axs)
+
+    axs[0].figure.tight_layout()
+    if show:
+        plt.show()
+    return axs
+
+
+def plot_CPS_density(tracks, kind="hexbin", gridsize=50, title="", axs=None, show=True):
+    """
+    Plots the density of points in the two phase space diagrams, e.g. for a whole climatology,
+    without drawing each track.
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The points, with the CPS parameters.
+    kind (str): "hexbin" or "hist2d".
+    gridsize (int): Number of bins in each direction.
+    title (str): Title of the figure.
+    axs: Two axes to draw on. By default, a new figure is created.
+    show (bool): Call plt.show() at the end.
+
+    Returns
+    -------
+    axs: The two axes.
+    """
+    if axs is None:
+        fig, axs = plt.subplots(1, 2, figsize=[11, 5])
+        fig.suptitle(title)
+
+    for ax, y in zip(axs, ["B", "VTU"]):
+        valid = tracks[["VTL", y]].notna().all(axis=1).values
+        x_values, y_values = tracks.VTL.values[valid], tracks[y].values[valid]
+        if kind == "hexbin":
+            mappable = ax.hexbin(x_values, y_values, gridsize=gridsize, bins="log", mincnt=1, cmap="viridis")
+        elif kind == "hist2d":
+            mappable = ax.hist2d(x_values, y_values, bins=gridsize, norm=LogNorm(), cmin=1, cmap="viridis")[3]
+        else:
+            raise ValueError("kind must be 'hexbin' or 'hist2d', not " + repr(kind))
+        ax.figure.colorbar(mappable, ax=ax, label="Number of points")
+    draw_axes(axs)
+
+    axs[0].figure.tight_layout()
+    if show:
+        plt.show()
+    return axs
+
+
+class CPSRenderer:
+    """
+    Off-screen (Agg) figure of the two phase space diagrams, reused for many tracks:
+    only the data of the lines, the limits and the title are updated for each track.
+    Does not use pyplot, so that it does not depend on the interactive backend.
+
+    Parameters
+    ----------
+    figsize (tuple): Size of the figure, in inches.
+    dpi (int): Resolution of the figure.
+    """
+
+    def __init__(self, figsize=(10, 5), dpi=100):
+        self.fig = Figure(figsize=figsize, dpi=dpi, layout="tight")
+        FigureCanvasAgg(self.fig)
+        self.axs = self.fig.subplots(1, 2)
+        self.title = self.fig.suptitle("")
+        self.lines = [ax.plot([], [], marker="o", color="k")[0] for ax in self.axs]
+        draw_axes(self.axs)
+
+    def render(self, track, path, title=""):
+        """
+        Writes the phase space diagrams of one track to path (format from the extension).
+        """
+        self.title.set_text(title)
+        for ax, line, y in zip(self.axs, self.lines, ["B", "VTU"]):
+            line.set_data(track.VTL.values, track[y].values)
+            ax.relim()
+            ax.autoscale_view()
+        self.fig.savefig(path)
+
+
+_renderer = None  # One renderer per process, reused for all its tracks
+
+
+def render_tracks(tracks, directory, fmt="png"):
+    """
+    Writes the phase space diagrams of each track in tracks to directory, see plot_CPS_batch.
+
+    Returns
+    -------
+    paths (list): The paths of the figures.
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = CPSRenderer()
+    starts = np.flatnonzero(track_starts(tracks))
+    paths = []
+    for start, stop in zip(starts, np.append(starts[1:], len(tracks))):
+        track = tracks.iloc[start:stop]
+        name = str(track.track_id.iloc[0])
+        if "member" in track.columns:
+            name = str(track.member.iloc[0]) + "_" + name
+        paths.append(os.path.join(directory, name + "." + fmt))
+        _renderer.render(track, paths[-1], title=name)
+    return paths
+
+
+def plot_CPS_batch(tracks, directory, fmt="png", max_workers=None, batch_size=100):
+    """
+    Writes the phase space diagrams of every track to a file, without display, in parallel.
+    Each process draws its tracks on a single reused Agg figure (see CPSRenderer).
+    Files are named <track_id>.<fmt> (<member>_<track_id>.<fmt> for ensembles).
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The output of compute_CPS_parameters.
+        The points of each track must be contiguous and sorted by time.
+    directory (str): The output directory, created if needed.
+    fmt (str): The format of the figures, e.g. "png" or "pdf".
+    max_workers (int): Number of processes. Defaults to the number of CPUs.
+    batch_size (int): Number of tracks sent to a process at once.
+
+    Returns
+    -------
+    paths (list): The paths of the figures, in the order of the tracks.
+    """
+    os.makedirs(directory, exist_ok=True)
+    starts = np.flatnonzero(track_starts(tracks))
+    bounds = np.append(starts[::batch_size], len(tracks))
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+        futures = [
+            pool.submit(render_tracks, tracks.iloc[start:stop], directory, fmt)
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        return [path for future in futures for path in future.result()]
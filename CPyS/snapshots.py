@@ -0,0 +1,205 @@
+import functools
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def polar_grid(dx=0.2, resx=50, naz=16):
+    """
+    Computes the radial/azimuthal snapshots grid, as in TempestExtremes' NodeFileCompose RAD grid.
+
+    Parameters
+    ----------
+    dx (float): Radial spacing of the grid (in great circle degrees)
+    resx (int): Number of points along the radius
+    naz (int): Number of azimuths. az is 0 for eastward and 90 for northward, as theta.
+
+    Returns
+    -------
+    r, az (np.ndarray): The radii and azimuths of the grid (in degrees), new arrays at each call.
+    """
+    r = (np.arange(resx) + 0.5) * dx
+    az = np.arange(naz) * 360 / naz
+    return r, az
+
+
+@functools.lru_cache(maxsize=16)
+def polar_trigonometry(dx=0.2, resx=50, naz=16):
+    """
+    Sines and cosines of the radii and bearings of the snapshots grid, which only depend on the grid,
+    shared by all the centers. Each entry takes (resx + naz) * 16 bytes (about 1 kB for the default grid).
+    The cached arrays are read-only.
+
+    Returns
+    -------
+    cos_δ, sin_δ (np.ndarray): (1, r, 1) cosine and sine of the radii
+    cos_β, sin_β (np.ndarray): (1, 1, az) cosine and sine of the bearings (clockwise from north)
+    """
+    r, az = polar_grid(dx, resx, naz)
+    δ = np.deg2rad(r)[np.newaxis, :, np.newaxis]
+    β = np.deg2rad(90 - az)[np.newaxis, np.newaxis, :]
+    trigonometry = np.cos(δ), np.sin(δ), np.cos(β), np.sin(β)
+    for a in trigonometry:
+        a.flags.writeable = False
+    return trigonometry
+
+
+def polar_points(lon0, lat0, dx=0.2, resx=50, naz=16):
+    """
+    Computes the coordinates of the snapshots grid points around each center, along great circles.
+
+    Parameters
+    ----------
+    lon0, lat0 (np.ndarray): The coordinates of the centers (in degrees)
+    dx, resx, naz: The snapshots grid, see polar_grid.
+
+    Returns
+    -------
+    lon, lat (np.ndarray): (center, r, az) coordinates of the snapshots grid points (in degrees)
+    """
+    cos_δ, sin_δ, cos_β, sin_β = polar_trigonometry(dx, resx, naz)
+    λ0 = np.deg2rad(np.asarray(lon0, dtype=float))[:, np.newaxis, np.newaxis]
+    φ0 = np.deg2rad(np.asarray(lat0, dtype=float))[:, np.newaxis, np.newaxis]
+    sin_φ0, cos_φ0 = np.sin(φ0), np.cos(φ0)
+    sin_φ = sin_φ0 * cos_δ + cos_φ0 * sin_δ * cos_β
+    λ = λ0 + np.arctan2(sin_β * sin_δ * cos_φ0, cos_δ - sin_φ0 * sin_φ)
+    return np.rad2deg(λ), np.rad2deg(np.arcsin(sin_φ))
+
+
+class PolarSampler:
+    """
+    Bilinear interpolation of a regular lat/lon grid onto the snapshots grid around track points.
+    The indices and weights are computed for all the centers of a call in one vectorized operation;
+    only the trigonometry of the snapshots grid is shared between calls (see polar_trigonometry),
+    as centers rarely come back exactly.
+
+    Parameters
+    ----------
+    lon, lat (np.ndarray): The coordinates of the regular lat/lon grid (lat may be decreasing)
+    dx, resx, naz: The snapshots grid, see polar_grid.
+    """
+
+    def __init__(self, lon, lat, dx=0.2, resx=50, naz=16):
+        self.lon0, self.dlon, self.nlon = float(lon[0]), float(lon[1] - lon[0]), len(lon)
+        self.lat0, self.dlat, self.nlat = float(lat[0]), float(lat[1] - lat[0]), len(lat)
+        self.periodic = np.isclose(self.nlon * abs(self.dlon), 360)
+        self.dx, self.resx, self.naz = dx, resx, naz
+
+    def compute_weights(self, lon0, lat0):
+        """
+        Computes the flat grid indices and bilinear weights for the snapshots around each center.
+
+        Returns
+        -------
+        idx (np.ndarray): (center, r, az, 4) flat indices in the (lat, lon) grid
+        w (np.ndarray): (center, r, az, 4) weights, NaN for points outside a regional grid
+        """
+        lon, lat = polar_points(lon0, lat0, self.dx, self.resx, self.naz)
+        fx = ((lon - self.lon0) % 360) / self.dlon
+        fy = (lat - self.lat0) / self.dlat
+        if self.periodic:
+            fy = np.clip(fy, 0, self.nlat - 1)
+            outside = np.zeros(fy.shape, dtype=bool)
+        else:
+            outside = (fx > self.nlon - 1) | (fy < 0) | (fy > self.nlat - 1)
+            fx, fy = np.clip(fx, 0, self.nlon - 1), np.clip(fy, 0, self.nlat - 1)
+        if self.periodic:
+            ix0 = np.floor(fx).astype(np.int64)
+            tx = fx - ix0
+            ix0 = ix0 % self.nlon
+        else:
+            ix0 = np.minimum(np.floor(fx).astype(np.int64), self.nlon - 2)
+            tx = fx - ix0
+        iy0 = np.minimum(np.floor(fy).astype(np.int64), self.nlat - 2)
+        ty = fy - iy0
+        ix1 = (ix0 + 1) % self.nlon
+        iy1 = iy0 + 1
+        idx = np.stack(
+            [iy0 * self.nlon + ix0, iy0 * self.nlon + ix1, iy1 * self.nlon + ix0, iy1 * self.nlon + ix1],
+            axis=-1,
+        )
+        w = np.stack([(1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty], axis=-1)
+        w[outside] = np.nan
+        return idx, w
+
+    def sample(self, field, lon0, lat0):
+        """
+        Interpolates the field onto the snapshots grid around each center.
+
+        Parameters
+        ----------
+        field (np.ndarray): (..., lat, lon) field
+        lon0, lat0 (np.ndarray): The coordinates of the centers
+
+        Returns
+        -------
+        snaps (np.ndarray): (center, ..., r, az) snapshots
+        """
+        idx, w = self.compute_weights(lon0, lat0)
+        flat = field.reshape(field.shape[:-2] + (-1,))
+        snaps = (flat[..., idx] * w).sum(axis=-1)  # (..., center, r, az)
+        return np.moveaxis(snaps, -3, 0)
+
+
+def extract_snapshots(
+    tracks,
+    geopt,
+    name="zg",
+    dx=0.2,
+    resx=50,
+    naz=16,
+    lon_name="lon",
+    lat_name="lat",
+    time_name="time",
+    varout=None,
+):
+    """
+    Extracts radial/azimuthal snapshots of a gridded field around each track point,
+    as TempestExtremes' NodeFileCompose would, without writing an intermediate file.
+    All the points at a given time are interpolated in one vectorized operation.
+
+    Parameters
+    ----------
+    tracks (pd.DataFrame): The set of TC points, with columns time, lon and lat.
+    geopt (xr.DataSet): The gridded field, on a regular lat/lon grid, with dimensions (time, level, lat, lon).
+    name (str): Name of the field in geopt.
+    dx (float): Radial spacing of the snapshots (in great circle degrees)
+    resx (int): Number of snapshot points along the radius
+    naz (int): Number of azimuths of the snapshots
+    lon_name, lat_name, time_name (str): Names of the coordinates in geopt.
+    varout (str): The snapshots are named "snap_" + varout. Defaults to name.
+
+    Returns
+    -------
+    snaps (xr.DataSet): The snapshots, with dimensions (snapshot, level, r, az),
+        in the same order as tracks, to be used with compute_CPS_parameters.
+    """
+    field = geopt[name]
+    levdim = [d for d in field.dims if d not in [time_name, lat_name, lon_name]]
+    assert len(levdim) == 1, "The field must have exactly one vertical dimension."
+    levdim = levdim[0]
+    field = field.transpose(time_name, levdim, lat_name, lon_name)
+
+    sampler = PolarSampler(field[lon_name].values, field[lat_name].values, dx, resx, naz)
+
+    time = pd.to_datetime(tracks.time).values
+    snaps = np.full((len(tracks), field.sizes[levdim], resx, naz), np.nan, dtype=field.dtype)
+    for t in np.unique(time):
+        points = np.nonzero(time == t)[0]
+        snaps[points] = sampler.sample(
+            field.sel({time_name: t}).values,
+            tracks.lon.values[points],
+            tracks.lat.values[points],
+        )
+
+    r, az = polar_grid(dx, resx, naz)
+    return xr.Dataset(
+        {
+            "snap_" + (varout or name): (("snapshot", levdim, "r", "az"), snaps),
+            "snap_lon": ("snapshot", tracks.lon.values),
+            "snap_lat": ("snapshot", tracks.lat.values),
+            "snap_time": ("snapshot", time),
+        },
+        coords={levdim: field[levdim].values, "r": r, "az": az},
+    )
@@ -1,5 +1,16 @@
+import functools
+
 import numpy as np
-import pyproj
+
+
+@functools.lru_cache(maxsize=None)
+def get_geod():
+    """
+    The WGS84 geodesic, built once. pyproj is only imported when a direction is first computed.
+    """
+    import pyproj
+
+    return pyproj.Geod(ellps="WGS84")
 
 
 def theta(x0=120, x1=130, y0=12, y1=10):
@@ -19,7 +30,7 @@ def theta(x0=120, x1=130, y0=12, y1=10):
     th (float): The directional angle between the current and the next point, in degrees.
         0 for eastward, 90 for northward.
     """
-    geodesic = pyproj.Geod(ellps="WGS84")
+    geodesic = get_geod()
     if (x1-x0, y1-y0) != (0,0):
         fwd_azimuth, back_azimuth, distance = geodesic.inv(x0, y0, x1, y1)
         return -1 * (fwd_azimuth - 90) % 360
@@ -63,43 +74,80 @@ def theta_track(lon, lat):
     return th
 
 
+def theta_vector(lon, lat, track_id):
+    """
+    Computes the angular direction for every point of a flat set of tracks, in one pass.
+    Gives the same result as applying theta_track to each track separately:
+    In stationnary cases and in the end of each track, the direction from the previous point is taken for the current point.
+    Points of a given track must be contiguous and sorted by time.
+
+    Parameters
+    ----------
+    lon: The longitudes of all the points
+    lat: The latitudes of all the points
+    track_id: The track identifier of each point
+
+    Returns
+    -------
+    th (np.ndarray): values of th for all the points.
+    """
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+    track_id = np.asarray(track_id)
+    assert len(lon) == len(lat) == len(track_id), "The vectors do not have the same length"
+    n = len(lon)
+    th = np.full(n, np.nan)
+    if n < 2:
+        return th
+
+    # Direction between each point and the following, with a single call to pyproj
+    geodesic = get_geod()
+    fwd_azimuth, back_azimuth, distance = geodesic.inv(
+        lon[:-1], lat[:-1], lon[1:], lat[1:]
+    )
+    th[:-1] = -1 * (fwd_azimuth - 90) % 360
+    th[:-1][(lon[1:] - lon[:-1] == 0) & (lat[1:] - lat[:-1] == 0)] = np.nan  # Stationnary points
+
+    # Track boundaries
+    new_track = track_id[1:] != track_id[:-1]
+    start = np.concatenate([[True], new_track])  # First point of each track
+    end = np.concatenate([new_track, [True]])  # Last point of each track
+    th[end] = np.nan  # The last point takes the direction of the point before
+
+    # Forward-fill missing directions within each track
+    idx = np.where(~np.isnan(th) | start, np.arange(n), 0)
+    np.maximum.accumulate(idx, out=idx)
+    return th[idx]
+
+
 def theta_multitrack(tracks):
     """
     Compute the angular direction for every tracks in a dataset.
     All tracks must have at least two points.
+    The points of each track must be contiguous and sorted by time.
 
     Parameters
     ----------
     tracks (pd.DataFrame): The set of TC points including columns:
+        * track_id
         * time
         * lon
         * lat
+        * member (optional): For ensembles, the tracks are identified by member and track_id.
 
     Returns
     -------
-    thetas (list): The list of angle for each point in the dataset
+    thetas (np.ndarray): The angle for each point in the dataset
     """
-
+    keys = ["member", "track_id"] if "member" in tracks.columns else ["track_id"]
     assert (
-        tracks.groupby("track_id").time.count().min() > 1
+        tracks.groupby(keys).time.count().min() > 1
     ), "The dataset contains tracks with only one point."
 
-    # Identify position of track point from the end of the track (tpos=0 for the last point)
-    tracks["tpos"] = (
-        tracks.sort_values("time", ascending=False)
-        .groupby("track_id")
-        .transform("cumcount")
-    )
-
-    lon, lat = tracks.lon.values, tracks.lat.values
-
-    # Run theta_track as if it was all one track
-    th = np.array(theta_track(lon, lat))
-
-    # Manage last point of each track : Set same angle as the point before
-    th[list((tracks.tpos == 0).values)] = th[list((tracks.tpos == 1).values)]
-
-    return th
+    if "member" in tracks.columns:
+        track_id = tracks.groupby(keys, sort=False).ngroup().values
+    else:
+        track_id = tracks.track_id.values
+    return theta_vector(tracks.lon.values, tracks.lat.values, track_id)
 
 
 if __name__ == "__main__":
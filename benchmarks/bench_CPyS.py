@@ -0,0 +1,145 @@
+"""
+Benchmark of the CPyS stages on synthetic data.
+
+Times and records the peak memory of theta_multitrack, B_vector, VT and compute_CPS_parameters,
+after checking that the vectorized engines match the reference implementations.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_CPyS --sizes 1e2 1e3 1e4 --output bench.json
+    python -m benchmarks.bench_CPyS --sizes 1e5 1e6 --on-disk /tmp --chunk-size 10000 --stages CPS
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from CPyS.theta import theta_track, theta_multitrack
+from CPyS.B import B_vector, B_vector_masks
+from CPyS.VT import VT, VT_linregress
+from CPyS.CPS import compute_CPS_parameters
+
+from .synthetic import make_tracks, make_snapshots
+
+
+def measure(func, *args, **kwargs):
+    """
+    Runs func twice: once for the wall time, once under tracemalloc for the peak of allocated memory.
+
+    Returns
+    -------
+    result, time (s), peak memory (bytes)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def prepare(geopt):
+    """The inputs of B_vector and VT, as prepared by compute_CPS_parameters."""
+    geopt = geopt.rename({"level": "plev"})
+    z900 = geopt.snap_zg.sel(plev=900e2, method="nearest")
+    z600 = geopt.snap_zg.sel(plev=600e2, method="nearest")
+    return z900, z600, geopt.sortby("plev", ascending=False)
+
+
+def check_equivalence(n=500, rtol=1e-7):
+    """
+    Checks that the vectorized engines give the same results as the reference implementations.
+
+    Returns
+    -------
+    errors (dict): The maximum relative difference for each stage
+    """
+    tracks, geopt = make_tracks(n), make_snapshots(n)
+    geopt.snap_zg[n // 2, 3] = np.nan  # A missing level
+    z900, z600, geopt_sorted = prepare(geopt)
+
+    th = theta_multitrack(tracks)
+    th_ref = np.concatenate([theta_track(list(t.lon), list(t.lat)) for _, t in tracks.groupby("track_id", sort=False)])
+    pairs = {
+        "theta": (th, th_ref),
+        "B": (B_vector(th, z900, z600, tracks.lat.values).values, B_vector_masks(th, z900, z600, tracks.lat.values).values),
+    }
+    (VTL, VTU), (VTL_ref, VTU_ref) = VT(geopt_sorted), VT_linregress(geopt_sorted)
+    pairs["VTL"], pairs["VTU"] = (VTL, np.array(VTL_ref)), (VTU, np.array(VTU_ref))
+
+    errors = {}
+    for stage, (new, ref) in pairs.items():
+        np.testing.assert_allclose(new, ref, rtol=rtol, atol=1e-9, err_msg=stage)
+        errors[stage] = float(np.nanmax(np.abs(new - ref) / np.maximum(np.abs(ref), 1e-9)))
+    return errors
+
+
+def run(n, stages, reference=False, on_disk=None, chunk_size=None):
+    """
+    Benchmarks the stages for n snapshots.
+
+    Returns
+    -------
+    records (list): One dict per stage, with the size, time, throughput and peak memory.
+    """
+    tracks = make_tracks(n)
+    if on_disk is not None:
+        path = os.path.join(on_disk, "snaps_" + str(n) + ".nc")
+        geopt = make_snapshots(n, path=path, chunk_size=chunk_size or 10000)
+    else:
+        geopt = make_snapshots(n)
+
+    records = []
+
+    def record(stage, func, *args, **kwargs):
+        result, elapsed, peak = measure(func, *args, **kwargs)
+        records.append(dict(stage=stage, n=n, time=elapsed, points_per_s=n / elapsed, peak_MB=peak / 1e6))
+        print("{:<22} n={:<9d} {:9.3f} s {:12.0f} points/s {:10.1f} MB".format(stage, n, elapsed, n / elapsed, peak / 1e6))
+        return result
+
+    if on_disk is None and ({"theta", "B", "VT"} & set(stages)):
+        z900, z600, geopt_sorted = prepare(geopt)
+        th = theta_multitrack(tracks)
+    if "theta" in stages:
+        record("theta_multitrack", theta_multitrack, tracks)
+    if "B" in stages and on_disk is None:
+        record("B_vector", B_vector, th, z900, z600, tracks.lat.values)
+        if reference:
+            record("B_vector_masks", B_vector_masks, th, z900, z600, tracks.lat.values)
+    if "VT" in stages and on_disk is None:
+        record("VT", VT, geopt_sorted)
+        if reference:
+            record("VT_linregress", VT_linregress, geopt_sorted)
+    if "CPS" in stages:
+        record("compute_CPS_parameters", compute_CPS_parameters, tracks, geopt, verbose=False, chunk_size=chunk_size)
+
+    geopt.close()
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e2, 1e3, 1e4], help="Numbers of snapshots (1e2 to 1e6)")
+    parser.add_argument("--stages", nargs="+", default=["theta", "B", "VT", "CPS"], choices=["theta", "B", "VT", "CPS"])
+    parser.add_argument("--reference", action="store_true", help="Also time the reference implementations")
+    parser.add_argument("--on-disk", metavar="DIR", help="Write the snapshots to NetCDF files in DIR and read them lazily")
+    parser.add_argument("--chunk-size", type=int, help="Chunk size for compute_CPS_parameters")
+    parser.add_argument("--output", help="Write the records to this json file")
+    args = parser.parse_args(argv)
+
+    print("Reference equivalence (max. relative difference):", check_equivalence())
+    records = []
+    for n in args.sizes:
+        records += run(int(n), args.stages, args.reference, args.on_disk, args.chunk_size)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(records, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark of the time taken by `import CPyS` (or one of its modules), in fresh interpreters.
+
+Also checks that the heavy optional modules are not imported by the core package,
+so that short-lived batch workers do not pay for them.
+
+Usage (from the root of the repository):
+    python -m benchmarks.bench_import --repeat 10 [--module CPyS.plot]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+LAZY_MODULES = ["matplotlib", "pyproj", "scipy"]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps(dict(time=elapsed, loaded=[m for m in {modules} if m in sys.modules])))
+"""
+
+
+def import_time(module="CPyS"):
+    """
+    Imports a module (CPyS by default) in a new interpreter.
+
+    Returns
+    -------
+    time (float): The import time (s)
+    loaded (list): The modules of LAZY_MODULES which were imported
+    """
+    out = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(module=module, modules=LAZY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(out.stdout)
+    return result["time"], result["loaded"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="Number of fresh imports")
+    parser.add_argument("--module", default="CPyS", help="Module to import (default: CPyS)")
+    args = parser.parse_args(argv)
+
+    times = []
+    for i in range(args.repeat):
+        elapsed, loaded = import_time(args.module)
+        times.append(elapsed)
+        if len(loaded) > 0:
+            print("Warning: `import " + args.module + "` imported " + ", ".join(loaded))
+    print("import " + args.module + ": median {:.3f} s, min {:.3f} s over {} runs".format(sorted(times)[len(times) // 2], min(times), len(times)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+PLEV = np.array([1000, 950, 900, 850, 800, 700, 600, 500, 400, 300, 250]) * 100.0
+
+
+def make_tracks(n_points, track_length=40, seed=0):
+    """
+    Generates a synthetic set of tracks, as random walks with 6-hourly points.
+
+    Parameters
+    ----------
+    n_points (int): Total number of points
+    track_length (int): Number of points of each track (the last track may be shorter, but has at least two points)
+    seed (int): Seed of the random generator
+
+    Returns
+    -------
+    tracks (pd.DataFrame): The set of points, with columns track_id, time, lon and lat.
+    """
+    rng = np.random.default_rng(seed)
+    track_id = np.arange(n_points) // track_length
+    if n_points % track_length == 1 and n_points > 1:
+        track_id[-1] = track_id[-2]  # No track with a single point
+    start = np.r_[True, track_id[1:] != track_id[:-1]]
+    step = np.arange(n_points) - np.maximum.accumulate(np.where(start, np.arange(n_points), 0))
+
+    # Random walk on a 0.25° grid, westward then poleward, starting from random points in the tropics
+    lon0 = np.round(rng.uniform(100, 300, track_id[-1] + 1) * 4) / 4
+    lat0 = np.round(rng.uniform(-25, 25, track_id[-1] + 1) * 4) / 4
+    dlon = rng.choice([-0.5, -0.25, 0, 0.25, 0.5, 0.75], n_points)
+    dlat = rng.choice([-0.25, 0, 0.25, 0.5], n_points) * np.where(lat0 < 0, -1, 1)[track_id]
+    dlon[start], dlat[start] = lon0, lat0
+    lon = pd.Series(dlon).groupby(track_id).cumsum().values % 360
+    lat = np.clip(pd.Series(dlat).groupby(track_id).cumsum().values, -80, 80)
+
+    time = pd.Timestamp("2000-01-01") + pd.to_timedelta(6 * step, unit="h")
+    return pd.DataFrame(dict(track_id=track_id, time=time, lon=lon, lat=lat))
+
+
+def make_snapshots_chunk(n, plev=PLEV, resx=10, naz=16, dtype=np.float32, seed=0):
+    """
+    Generates n synthetic geopotential snapshots (in m), as a standard atmosphere
+    with a cyclone of random intensity, vertical structure and asymmetry.
+
+    Returns
+    -------
+    zg (np.ndarray): (snapshot, plev, r, az) snapshots
+    """
+    rng = np.random.default_rng(seed)
+    r = (np.arange(resx) + 0.5) / resx * 10
+    az = np.deg2rad(np.arange(naz) * 360 / naz)
+    z_std = 7000 * np.log(1e5 / plev)  # Standard atmosphere
+    depth = rng.uniform(20, 150, (n, 1, 1, 1)) * (1 + rng.uniform(-1, 1, (n, 1, 1, 1)) * (plev[:, None, None] / 1e5 - 0.6))
+    asym = rng.uniform(0, 20, (n, 1, 1, 1)) * np.cos(az - rng.uniform(0, 2 * np.pi, (n, 1, 1, 1))) * r[:, None]
+    zg = z_std[:, None, None] - depth * np.exp(-r[:, None] / 3) + asym + rng.normal(0, 1, (n, len(plev), resx, naz))
+    return zg.astype(dtype)
+
+
+def make_snapshots(n_snapshots, plev=PLEV, resx=10, naz=16, dtype=np.float32, seed=0, path=None, chunk_size=10000):
+    """
+    Generates a synthetic NodeFileCompose-like snapshots Dataset.
+
+    Parameters
+    ----------
+    n_snapshots (int): Number of snapshots
+    plev (np.ndarray): The levels (in Pa)
+    resx, naz (int): Number of radii and azimuths
+    dtype: Data type of the snapshots
+    seed (int): Seed of the random generator
+    path (str): If provided, the snapshots are written to this NetCDF file by chunks of chunk_size,
+        so that sizes larger than the memory can be generated, and the file is opened lazily.
+
+    Returns
+    -------
+    geopt (xr.DataSet): The snapshots, with variable snap_zg (snapshot, level, r, az).
+    """
+    coords = dict(level=plev, r=(np.arange(resx) + 0.5) / resx * 10, az=np.arange(naz) * 360 / naz)
+    if path is None:
+        zg = make_snapshots_chunk(n_snapshots, plev, resx, naz, dtype, seed)
+        return xr.Dataset({"snap_zg": (("snapshot", "level", "r", "az"), zg)}, coords=coords)
+
+    import netCDF4
+
+    with netCDF4.Dataset(path, "w") as nc:
+        for dim, size in [("snapshot", None), ("level", len(plev)), ("r", resx), ("az", naz)]:
+            nc.createDimension(dim, size)
+        for dim in ["level", "r", "az"]:
+            nc.createVariable(dim, "f8", (dim,))[:] = coords[dim]
+        var = nc.createVariable("snap_zg", dtype, ("snapshot", "level", "r", "az"), chunksizes=(min(chunk_size, n_snapshots), len(plev), resx, naz))
+        for i, start in enumerate(range(0, n_snapshots, chunk_size)):
+            n = min(chunk_size, n_snapshots - start)
+            var[start : start + n] = make_snapshots_chunk(n, plev, resx, naz, dtype, seed + i)
+    return xr.open_dataset(path)
@@ -1,8 +1,15 @@
+import os
+import re
+
 import setuptools
 
+# The version is only written in CPyS/__init__.py
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "CPyS", "__init__.py")) as f:
+    version = re.search(r'^__version__ = "(.*)"', f.read(), re.M).group(1)
+
 setuptools.setup(
     name="CPyS",
-    version="0.0.6",
+    version=version,
     author="Stella Bourdin",
     author_email="stella.bourdin@lsce.ipsl.fr",
     description="A python package from compute the Hart Cyclone Phase Space parameters",
@@ -17,6 +24,12 @@ setuptools.setup(
     ],
     python_requires='>=3.6',
     install_requires=["numpy", "pandas", "xarray","pyproj","matplotlib"],
+    extras_require={
+        "parquet": ["pyarrow"],
+        "netcdf": ["netCDF4"],
+        "dev": ["pytest", "netCDF4", "scipy", "dask", "zarr"],  # To run the tests (CI: pip install .[dev])
+    },
+    entry_points={"console_scripts": ["cpys=CPyS.cli:main"]},
     #include_package_data=True,
     #package_data={"":['_data/*.csv', "_data/iho.*"]}
 )
@@ -1,6 +1,24 @@
+import os
 import pytest
+import numpy as np
+import pandas as pd
+import xarray as xr
 
-from CPyS.theta import theta, theta_track
+from CPyS.theta import theta, theta_track, theta_vector, theta_multitrack
+from CPyS.B import B_vector, B_vector_masks
+from CPyS.VT import VT, VT_linregress, slopes
+from CPyS.CPS import compute_CPS_parameters, iter_CPS_parameters, update_CPS_parameters, prepare_geopt, mask_fill_values, compute_chunk
+from CPyS.inputs import open_snapshots, snapshot_chunks, chunk_bounds
+from CPyS.phase import compute_phases, classify, transition_times
+from CPyS.index import SnapshotIndex
+from CPyS.cache import ResultCache, file_fingerprint
+from CPyS.batch import compute_CPS_batch, compute_pair
+from CPyS.cli import main
+from CPyS.snapshots import extract_snapshots, polar_points, polar_grid
+from benchmarks.bench_CPyS import check_equivalence
+from benchmarks.bench_import import import_time
+from CPyS.profiling import Profiler
+from CPyS.grid import PolarGrid
 
 def test_theta():
     x0, x1, y0, y1 = 0, 1, 0, 0 # Eastward
@@ -18,4 +36,413 @@ def test_theta_track():
     t = theta_track(lon, lat)
     assert len(t) == len(lon)
     assert t == pytest.approx([0, 90, 180, 270, 270], 0.01)
-    
\ No newline at end of file
+
+def test_theta_vector():
+    # Two tracks, with stationnary points at the start, in the middle and at the end
+    lon = [0, 0, 1, 1, 1, 0, 5, 5, 6, 6, 6]
+    lat = [0, 0, 0, 1, 1, 1, 5, 6, 6, 6, 7]
+    track_id = [1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2]
+    th = theta_vector(lon, lat, track_id)
+    ref = theta_track(lon[:6], lat[:6]) + theta_track(lon[6:], lat[6:])
+    np.testing.assert_array_equal(th, ref)
+    assert np.isnan(th[0])
+
+def test_theta_multitrack():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    th = theta_multitrack(tracks)
+    assert type(th) == np.ndarray
+    np.testing.assert_array_equal(th, theta_track(list(tracks.lon), list(tracks.lat)))
+
+def test_B_vector():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc").rename({"level": "plev"})
+    z900 = geopt.snap_zg.sel(plev=900e2)
+    z600 = geopt.snap_zg.sel(plev=600e2).copy()
+    th = theta_multitrack(tracks)
+    np.testing.assert_allclose(
+        B_vector(th, z900, z600, tracks.lat.values),
+        B_vector_masks(th, z900, z600, tracks.lat.values),
+    )
+    # With missing values
+    z600[3, 2, 5] = np.nan
+    z600[5] = np.nan
+    np.testing.assert_allclose(
+        B_vector(th, z900, z600, tracks.lat.values),
+        B_vector_masks(th, z900, z600, tracks.lat.values),
+    )
+
+def test_VT():
+    geopt = xr.open_dataset("demo/Dale.nc").rename({"level": "plev"})
+    geopt = geopt.sortby("plev", ascending=False)
+    geopt.snap_zg[4, 10] = np.nan
+    for new, ref in zip(VT(geopt), VT_linregress(geopt)):
+        np.testing.assert_allclose(new, ref)
+
+def test_slopes():
+    x = np.log([1000, 900, 800, 700, 600])
+    Y = np.array([[1, 2, 3, 4, 5], [1, 2, np.nan, 4, 7], [np.nan] * 4 + [1]])
+    assert np.isnan(slopes(x, Y)[1:]).all()
+    s = slopes(x, Y, skipna=True)
+    assert s[0] == pytest.approx(np.polyfit(x, Y[0], 1)[0])
+    assert s[1] == pytest.approx(np.polyfit(x[[0, 1, 3, 4]], Y[1, [0, 1, 3, 4]], 1)[0])
+    assert np.isnan(s[2])
+
+def test_compute_CPS_parameters_chunks():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc")
+    ref = compute_CPS_parameters(tracks, geopt, verbose=False)
+    for chunk_size in [4, 10, 100]:
+        df = compute_CPS_parameters(tracks, geopt, verbose=False, chunk_size=chunk_size)
+        assert list(df.index) == list(ref.index)
+        for param in ["theta", "B", "VTL", "VTU"]:
+            np.testing.assert_allclose(df[param], ref[param])
+
+    # Tracks as an xr.Dataset (huracanpy) are computed in a single chunk by default
+    profiler = Profiler()
+    df = compute_CPS_parameters(tracks.to_xarray(), geopt, verbose=False, profiler=profiler)
+    assert profiler.stages["B"]["calls"] == 1 and profiler.stages["VT"]["calls"] == 1
+    np.testing.assert_allclose(df.B, ref.B)
+
+def test_snapshot_inputs(tmp_path):
+    pytest.importorskip("zarr")
+    pytest.importorskip("dask")
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc")
+    ref = compute_CPS_parameters(tracks, geopt, verbose=False)
+    assert chunk_bounds(35, 15, (10, 10, 10, 5)) == [(0, 20), (20, 35)]
+    assert chunk_bounds(35, 15) == [(0, 15), (15, 30), (30, 35)]
+    geopt.chunk(snapshot=10).to_zarr(tmp_path / "Dale.zarr")
+    geopt.isel(snapshot=slice(0, 20)).to_netcdf(tmp_path / "Dale_0.nc")
+    geopt.isel(snapshot=slice(20, None)).to_netcdf(tmp_path / "Dale_1.nc")
+    zarr_store = open_snapshots(str(tmp_path / "Dale.zarr"))
+    assert snapshot_chunks(zarr_store) == (10, 10, 10, 5)
+    for source in [str(tmp_path / "Dale.zarr"), [str(tmp_path / "Dale_0.nc"), str(tmp_path / "Dale_1.nc")], str(tmp_path / "Dale_*.nc")]:
+        for prefetch in [True, False]:
+            df = compute_CPS_parameters(tracks, source, verbose=False, chunk_size=15, prefetch=prefetch)
+            for param in ["theta", "B", "VTL", "VTU"]:
+                np.testing.assert_allclose(df[param], ref[param])
+        with pytest.raises(ValueError):  # The time of the snapshots is kept to check the alignment
+            compute_CPS_parameters(tracks.iloc[::-1], source, verbose=False)
+
+def open_files(path):
+    fds = os.listdir("/proc/self/fd")
+    return sum(os.path.realpath(os.path.join("/proc/self/fd", fd)) == os.path.realpath(path) for fd in fds)
+
+def test_snapshot_inputs_closed(tmp_path, monkeypatch):
+    if not os.path.isdir("/proc/self/fd"):
+        pytest.skip("Needs /proc")
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    path = str(tmp_path / "Dale.nc")
+    xr.open_dataset("demo/Dale.nc").load().to_netcdf(path)
+    import CPyS.CPS
+    opened = [] # Keeps the datasets alive, so that they are not closed by the garbage collector
+    monkeypatch.setattr(CPyS.CPS, "open_snapshots", lambda *args: opened.append(open_snapshots(*args)) or opened[-1])
+    compute_CPS_parameters(tracks, path, verbose=False, chunk_size=10)
+    assert open_files(path) == 0
+    chunks = iter_CPS_parameters(tracks, path, verbose=False, chunk_size=10)
+    next(chunks)
+    assert open_files(path) == 1
+    chunks.close() # Stopped early
+    assert open_files(path) == 0
+    with xr.open_dataset(path) as geopt: # Datasets are left open for the caller
+        compute_CPS_parameters(tracks, geopt, verbose=False)
+        assert open_files(path) == 1
+
+def test_members():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc")[["snap_zg"]].load()
+    lengths = [35, 30, 20]
+    members = [tracks.iloc[:n].assign(member=m, lon=tracks.lon.iloc[:n] + m) for m, n in enumerate(lengths)]
+    snapshots = [geopt * (1 + 0.05 * m) for m in range(len(lengths))]
+    ensemble = compute_CPS_parameters(
+        pd.concat(members), xr.concat(snapshots, dim="member").assign_coords(member=range(3)), verbose=False
+    )
+    assert list(ensemble.member) == sum([[m] * n for m, n in enumerate(lengths)], [])
+    for m, n in enumerate(lengths):
+        ref = compute_CPS_parameters(members[m], snapshots[m].isel(snapshot=slice(n)), verbose=False)
+        for param in ["theta", "B", "VTL", "VTU"]:
+            np.testing.assert_allclose(ensemble[ensemble.member == m][param], ref[param])
+
+    # Broadcasting over the member dimension in the kernels
+    z = xr.concat(snapshots, dim="member").snap_zg.rename(level="plev")
+    th = np.stack([theta_multitrack(tracks)] * 3)
+    lat = np.stack([tracks.lat.values] * 3)
+    B = B_vector(th, z.sel(plev=900e2), z.sel(plev=600e2), lat)
+    assert B.dims == ("member", "snapshot")
+    np.testing.assert_allclose(B[1], B_vector(th[1], z[1].sel(plev=900e2), z[1].sel(plev=600e2), lat[1]))
+    VTL, VTU = VT(z.sortby("plev", ascending=False).to_dataset(name="snap_zg"))
+    assert VTL.shape == (3, 35)
+    np.testing.assert_allclose(VTU[2], VT(z[2].sortby("plev", ascending=False).to_dataset(name="snap_zg"))[1])
+
+def test_phases():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    df = compute_CPS_parameters(tracks, xr.open_dataset("demo/Dale.nc"), verbose=False)
+    df = pd.concat([df, df.iloc[:20].assign(track_id=1, B=df.B.iloc[:20] - 20)], ignore_index=True)
+    phases = compute_phases(df)
+    for track_id, track in phases.groupby("track_id"):
+        ref = track.set_index(pd.to_datetime(track.time)).B.rolling("24h", center=True, min_periods=1, closed="both").mean()
+        np.testing.assert_allclose(track.B_smooth, ref)
+    assert list(phases.phase.iloc[[0, 15, 34]]) == ["SWC", "AWC", "ACC"]
+    assert list(classify([0, 0, 20, 20, np.nan], [1, -1, 1, -1, 1])) == ["SWC", "SCC", "AWC", "ACC", ""]
+    transitions = transition_times(phases).set_index("track_id")
+    assert transitions.onset[1277] == pd.Timestamp("1996-11-08 18:00")
+    assert transitions.completion[1277] == pd.Timestamp("1996-11-12 18:00")
+    assert pd.isna(transitions.onset[1]) and pd.isna(transitions.completion[1])
+    at_threshold = pd.DataFrame(dict(track_id=1, time=pd.date_range("2000", periods=3, freq="6h"), B=[0, 10, 20], VTL=[1, 1, -1]))
+    assert list(classify(at_threshold.B, at_threshold.VTL)) == ["SWC", "AWC", "ACC"]
+    assert transition_times(at_threshold).onset[0] == at_threshold.time[1] # Onset at the first asymmetric point
+    at_zero = at_threshold.assign(VTL=[1, 0, -1])
+    assert list(classify(at_zero.B, at_zero.VTL)) == ["SWC", "ACC", "ACC"]
+    assert transition_times(at_zero).completion[0] == at_zero.time[1] # Completion at the first cold core point
+
+def test_plots(tmp_path):
+    pytest.importorskip("matplotlib")
+    from CPyS.plot import plot_CPS_batch, plot_CPS_density
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    df = compute_CPS_parameters(tracks, xr.open_dataset("demo/Dale.nc"), verbose=False)
+    df = pd.concat([df, df.iloc[:20].assign(track_id=1)], ignore_index=True)
+    paths = plot_CPS_batch(df, str(tmp_path), max_workers=2, batch_size=1)
+    assert paths == [str(tmp_path / "1277.png"), str(tmp_path / "1.png")]
+    for path in paths:
+        with open(path, "rb") as f:
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+    for kind in ["hexbin", "hist2d"]:
+        axs = plot_CPS_density(df, kind=kind, gridsize=10, show=False)
+        assert axs[0].get_ylabel() == "B / m"
+    with pytest.raises(ValueError):
+        plot_CPS_density(df, kind="scatter", show=False)
+
+def test_snapshot_index(tmp_path, caplog):
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc")
+    ref = compute_CPS_parameters(tracks, geopt, verbose=False)
+    with pytest.raises(ValueError):  # Misaligned tracks and snapshots
+        compute_CPS_parameters(tracks.iloc[::-1], geopt, verbose=False)
+    compute_CPS_parameters(tracks, geopt[["snap_zg"]], verbose=False)
+    assert "cannot check" in caplog.text  # No time to check the alignment
+
+    index = SnapshotIndex.from_tracks(tracks, geopt)
+    index.save(tmp_path / "Dale.npz")
+    index = SnapshotIndex.load(tmp_path / "Dale.npz")
+    assert list(SnapshotIndex.from_dataset(index.attach(geopt)).positions(tracks)) == list(range(35))
+    two_storms = pd.concat([tracks, tracks.iloc[:12].assign(track_id=1)], ignore_index=True)
+    geopt2 = xr.concat([geopt[["snap_zg"]], geopt[["snap_zg"]].isel(snapshot=slice(12))], dim="snapshot")
+    index = SnapshotIndex.from_tracks(two_storms)
+
+    subset = tracks.iloc[::-1]  # One storm, in any order
+    df = compute_CPS_parameters(subset, geopt2, verbose=False, index=index, chunk_size=10)
+    assert list(df.index) == list(subset.index)
+    for param in ["theta", "B", "VTL", "VTU"]:
+        np.testing.assert_allclose(df[param], ref[param].iloc[::-1])
+    with pytest.raises(ValueError):
+        compute_CPS_parameters(tracks.assign(track_id=2), geopt2, verbose=False, index=index)
+
+def test_result_cache(tmp_path):
+    import shutil
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    shutil.copy("demo/Dale.nc", tmp_path / "Dale.nc")
+    ref = compute_CPS_parameters(tracks, xr.open_dataset("demo/Dale.nc"), verbose=False)
+    cache = ResultCache(tmp_path / "cache")
+    for source in [xr.open_dataset(tmp_path / "Dale.nc"), str(tmp_path / "Dale.nc")]:
+        cache.clear()
+        counts = []
+        for run in range(2):
+            profiler = Profiler()
+            df = compute_CPS_parameters(tracks, source, verbose=False, chunk_size=10, cache=cache, profiler=profiler)
+            counts.append(profiler.counts.get("cached_snapshots", 0))
+            for param in ["theta", "B", "VTL", "VTU"]:
+                np.testing.assert_allclose(df[param], ref[param])
+        assert counts == [0, 35]
+        assert len(cache.entries()) == 4
+    assert "read" not in profiler.stages  # Files are not read when all the chunks are cached
+
+    # Changed tracks are recomputed, the other chunks are reused
+    profiler = Profiler()
+    compute_CPS_parameters(tracks.assign(lat=tracks.lat.where(tracks.index != 25, 30)), str(tmp_path / "Dale.nc"),
+                           verbose=False, chunk_size=10, cache=str(tmp_path / "cache"), profiler=profiler)
+    assert profiler.counts["cached_snapshots"] == 25
+
+    # Least recently used entries are evicted
+    small = ResultCache(tmp_path / "cache", max_size=cache.size() // 2)
+    small.evict()
+    assert 0 < len(small.entries()) < 8
+
+def test_result_cache_listing(tmp_path, monkeypatch):
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listings.append(path) or listdir(path))
+    cache = ResultCache(tmp_path)
+    for i in range(20):
+        cache.put(str(i), B=np.zeros(100))
+    assert len(listings) == 1  # The directory is listed once, not at each put
+    cache.max_size = 5 * os.path.getsize(cache.path("0"))
+    cache.put("20", B=np.zeros(100))
+    assert len(listings) == 2  # And again to evict
+    assert len(cache.entries()) == 5
+    assert cache.get("20") is not None
+
+def test_compute_CPS_batch():
+    manifest = [
+        ("demo/Dale.csv", "demo/Dale.nc"),
+        ("demo/Dale.csv", "missing.nc"),
+        ("demo/Dale.csv", "demo/Dale.nc"),
+    ]
+    df = compute_CPS_batch(manifest, max_workers=2, verbose=False)
+    ref = compute_CPS_parameters(pd.read_csv("demo/Dale.csv", index_col=False), xr.open_dataset("demo/Dale.nc"), verbose=False)
+    assert list(df.item.unique()) == [0, 2]
+    np.testing.assert_allclose(df[df.item == 2].B, ref.B)
+
+def crashing_pair(tracks, snapshots, **kwargs):
+    if tracks == "crash":
+        os._exit(1)  # Kills the worker, which breaks the pool
+    return compute_pair(tracks, snapshots, **kwargs)
+
+def test_compute_CPS_batch_crash(monkeypatch, caplog):
+    import CPyS.batch
+    monkeypatch.setattr(CPyS.batch, "compute_pair", crashing_pair)
+    manifest = [("crash", "demo/Dale.nc")] + [("demo/Dale.csv", "demo/Dale.nc")] * 4
+    for retries in [0, 1]:
+        caplog.clear()
+        df = compute_CPS_batch(manifest, max_workers=2, retries=retries, verbose=False)
+        assert list(df.item.unique()) == [1, 2, 3, 4]
+        assert [r.levelname for r in caplog.records if r.message.startswith("Failed")] == ["WARNING"]
+
+def test_cli(tmp_path, monkeypatch):
+    pytest.importorskip("netCDF4")
+    import CPyS.CPS
+    fingerprints, computed = [], []
+    monkeypatch.setattr(CPyS.CPS, "file_fingerprint", lambda source: fingerprints.append(source) or file_fingerprint(source))
+    monkeypatch.setattr(CPyS.CPS, "compute_chunk", lambda *args, **kwargs: computed.append(1) or compute_chunk(*args, **kwargs))
+    ref = compute_CPS_parameters(pd.read_csv("demo/Dale.csv", index_col=False), xr.open_dataset("demo/Dale.nc"), verbose=False)
+    for run in range(2):
+        computed.clear()
+        argv = ["demo/Dale.csv", "demo/Dale.nc", "-o", str(tmp_path / "out.nc"), "--chunk-size", "10", "-q"]
+        assert main(argv + ["--cache", str(tmp_path / "cache")]) == 0
+        with xr.open_dataset(tmp_path / "out.nc") as out:
+            np.testing.assert_allclose(out.B, ref.B)
+            np.testing.assert_allclose(out.VTL, ref.VTL)
+            assert list(out.time.values) == list(ref.time)
+    assert fingerprints == ["demo/Dale.nc"] * 2  # The files are fingerprinted, not read and hashed
+    assert computed == []  # Unchanged rerun: everything comes from the cache
+
+def test_extract_snapshots():
+    lon, lat = np.arange(0, 360, 1.0), np.arange(90, -90.5, -1.0)
+    plev = np.array([1000, 900, 800, 700, 600, 500, 400, 300, 250]) * 100.0
+    time = pd.date_range("2000-01-01", periods=2, freq="6h")
+    zg = np.broadcast_to(lat[:, None], (2, len(plev), len(lat), len(lon))) # z = lat, interpolated exactly
+    geopt = xr.Dataset({"zg": (("time", "plev", "lat", "lon"), zg)}, coords=dict(time=time, plev=plev, lat=lat, lon=lon))
+    tracks = pd.DataFrame(dict(track_id=[1, 1, 2], time=[time[0], time[1], time[1]], lon=[150, 152, 359.5], lat=[10, 12, -20]))
+    snaps = extract_snapshots(tracks, geopt, dx=0.5, resx=10, naz=8)
+    assert snaps.snap_zg.dims == ("snapshot", "plev", "r", "az")
+    assert snaps.snap_zg.shape == (3, len(plev), 10, 8)
+    np.testing.assert_allclose(snaps.snap_zg.isel(plev=0), polar_points(tracks.lon, tracks.lat, 0.5, 10, 8)[1])
+    np.testing.assert_allclose(snaps.snap_zg.isel(plev=0).sel(az=90), tracks.lat.values[:, None] + snaps.r.values)
+    r, az = polar_grid(0.5, 10, 8)
+    r[:] = 0 # Editing the grid of a result does not change the next ones
+    assert polar_grid(0.5, 10, 8)[0][0] == 0.25
+
+def test_benchmark_equivalence():
+    errors = check_equivalence(n=200)
+    assert set(errors) == {"theta", "B", "VTL", "VTU"}
+
+def test_profiler():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc").load()
+    geopt.snap_zg[3, 2, 2, 2] = 1e20 # Fill value
+    calls = []
+    profiler = Profiler(callback=lambda stage, stats: calls.append(stage))
+    compute_CPS_parameters(tracks, geopt, verbose=False, chunk_size=20, profiler=profiler)
+    assert set(profiler.stages) == {"curation", "theta", "read", "mask", "B", "VT"}
+    assert profiler.stages["B"]["calls"] == 2
+    assert calls.count("VT") == 2
+    assert profiler.counts["snapshots"] == 35
+    assert profiler.counts["masked_snapshots"] == 1
+
+def test_compute_CPS_parameters_float32():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc").astype("float64")
+    geopt.snap_zg[3, 2, 2, 2] = 1e20 # Fill value
+    snap_zg = geopt.snap_zg.values.copy()
+    ref = compute_CPS_parameters(tracks, geopt, verbose=False)
+    df = compute_CPS_parameters(tracks, geopt, verbose=False, dtype=np.float32)
+    np.testing.assert_array_equal(geopt.snap_zg.values, snap_zg) # The input is not modified
+    for param in ["B", "VTL", "VTU"]:
+        np.testing.assert_allclose(df[param], ref[param], atol=1e-3)
+
+def test_mask_in_place(tmp_path):
+    geopt = xr.open_dataset("demo/Dale.nc").load()
+    geopt.snap_zg[3, 2, 2, 2] = 1e20 # Fill value
+    geopt.to_netcdf(tmp_path / "Dale.nc")
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    with xr.open_dataset(tmp_path / "Dale.nc") as lazy:
+        chunk = prepare_geopt(lazy).isel(snapshot=slice(0, 10)).load()  # As read by iter_CPS_parameters
+    z = chunk.snap_zg
+    masked = mask_fill_values(z, inplace=True)
+    assert np.shares_memory(masked.values, z.values) # No copy
+    assert np.isnan(z.values).sum() == 1
+    masked = mask_fill_values(geopt.snap_zg)
+    assert not np.shares_memory(masked.values, geopt.snap_zg.values)
+    assert geopt.snap_zg.values[3, 2, 2, 2] == 1e20
+    df = compute_CPS_parameters(tracks, geopt, verbose=False, chunk_size=10)
+    assert geopt.snap_zg.values[3, 2, 2, 2] == 1e20 # The input is not modified
+    assert np.isfinite(df.B.values[3])
+
+def test_update_CPS_parameters():
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc")
+    ref = compute_CPS_parameters(tracks, geopt, verbose=False)
+    df = compute_CPS_parameters(tracks.iloc[:20], geopt.isel(snapshot=slice(0, 20)), verbose=False)
+    for start, end in [(20, 21), (21, 30), (30, 35)]: # Successive cycles
+        df = update_CPS_parameters(
+            df,
+            tracks.iloc[start:end],
+            geopt.isel(snapshot=slice(start, end)),
+            previous_geopt=geopt.isel(snapshot=slice(0, start)),
+            verbose=False,
+        )
+    assert len(df) == 35
+    for param in ["theta", "B", "VTL", "VTU"]:
+        np.testing.assert_allclose(df[param], ref[param])
+
+    # Ensemble: the same track_id in two members are different tracks
+    members = [tracks.assign(member=0), tracks.assign(member=1, lon=tracks.lon * 1.01)]
+    previous = pd.concat([m.iloc[:20] for m in members], ignore_index=True)
+    previous_geopt = xr.concat([geopt[["snap_zg"]].isel(snapshot=slice(0, 20))] * 2, dim="snapshot")
+    df = compute_CPS_parameters(previous, previous_geopt, verbose=False)
+    profiler = Profiler()
+    df = update_CPS_parameters(
+        df, members[0].iloc[20:25], geopt.isel(snapshot=slice(20, 25)), previous_geopt=previous_geopt,
+        verbose=False, profiler=profiler,
+    )
+    assert profiler.stages["B"]["calls"] == 2 and profiler.stages["VT"]["calls"] == 1 # Only B for the revised point
+    ref0 = compute_CPS_parameters(members[0].iloc[:25], geopt.isel(snapshot=slice(0, 25)), verbose=False)
+    ref1 = compute_CPS_parameters(members[1].iloc[:20], geopt.isel(snapshot=slice(0, 20)), verbose=False)
+    for param in ["theta", "B", "VTL", "VTU"]:
+        np.testing.assert_allclose(df[df.member == 0][param], ref0[param])
+        np.testing.assert_allclose(df[df.member == 1][param], ref1[param])
+
+def test_PolarGrid():
+    az = np.arange(16) * 22.5
+    grid = PolarGrid(np.array([250, 500, 600, 850, 900, 950, 1000]) * 100, np.arange(10) + 0.5, az)
+    th = np.r_[np.linspace(0, 360, 1001), 11.25, 348.75, np.nan]
+    np.testing.assert_array_equal(grid.az[grid.snap(th)], xr.DataArray(az, coords={"az": az}).sel(az=th, method="nearest").az)
+    np.testing.assert_array_equal(grid.plev, np.array([950, 900, 850, 600, 500, 250]) * 100)
+    np.testing.assert_array_equal(grid.plev[grid.B_idx], [900e2, 600e2])
+
+    tracks = pd.read_csv("demo/Dale.csv", index_col=False)
+    geopt = xr.open_dataset("demo/Dale.nc")
+    grid = PolarGrid.from_dataset(geopt)
+    ref = compute_CPS_parameters(tracks, geopt, verbose=False)
+    df = compute_CPS_parameters(tracks, geopt, verbose=False, grid=grid)
+    for param in ["B", "VTL", "VTU"]:
+        np.testing.assert_array_equal(df[param], ref[param])
+    with pytest.raises(ValueError):
+        compute_CPS_parameters(tracks, geopt.isel(r=slice(0, 10)), verbose=False, grid=grid)
+
+def test_lazy_imports():
+    elapsed, loaded = import_time()
+    assert loaded == []
+    elapsed, loaded = import_time("CPyS.plot")
+    assert loaded == ["matplotlib"]
+    import CPyS
+    assert callable(CPyS.plot_CPS)